@@ -10,6 +10,10 @@ import crcmod
 import os
 import sys
 
+# names of the 'target' bits, as ZD2's 'targets'
+TARGETS = ["g-series", "0x0002", "0x0004", "0x0008", "0x0010", "0x0020",
+        "0x0040", "ms-50g+", "ms-200d+", "ms-80ir+"]
+
 #--------------------------------------------------
 def main():
     from argparse import ArgumentParser
@@ -112,13 +116,25 @@ def main():
     if not len(options.files):
         parser.error("FILE not specified")
 
+    # Header fields are read lazily, only extracting or modifying
+    # needs the whole file to be parsed
+    effect = None
+    if options.summary or options.id or options.version:
+        try:
+            effect = zoomzt2.ZD2Reader(options.files[0])
+        except ValueError as e:
+            sys.exit("Unable to read ZD2 effect: %s" % e)
+
     # Read data from file
-    infile = open(options.files[0], "rb")
-    if not infile:
-        sys.exit("Unable to open FILE for reading")
-    else:
-        data = infile.read()
-    infile.close()
+    data = None
+    if options.crc or options.dump or options.bitmap or options.info or \
+            options.code or options.xml or options.text or options.output:
+        infile = open(options.files[0], "rb")
+        if not infile:
+            sys.exit("Unable to open FILE for reading")
+        else:
+            data = infile.read()
+        infile.close()
 
     if options.crc and data:
         config = zoomzt2.ZD2.parse(data)
@@ -137,44 +153,41 @@ def main():
         config = zoomzt2.ZD2.parse(data)
         print(config)
 
-    if options.summary and data:
-        config = zoomzt2.ZD2.parse(data)
-
-        print("0x%8.8x : %s, %s (v%s %2.2f%%)" % (config['id'], \
+    if options.summary and effect:
+        print("0x%8.8x : %s, %s (v%s %2.2f%%)" % (effect.id, \
                 os.path.split(options.files[0])[-1], \
-                config['name'], config['version'], config['INFO']['dspload']/2.5), \
+                effect.name, effect.version, effect.dspload()/2.5), \
                 end="")
 
         if options.md5sum:
-            md5sum = hashlib.md5(data).hexdigest()
+            md5sum = hashlib.md5(effect.view).hexdigest()
             print(", %s" % md5sum, end="")
 
         if options.target:
-            print(", 0x%8.8x" % config['target'], end="")
+            print(", 0x%8.8x" % effect.target, end="")
 
         print("")
 
         if options.targets:
             print("Effect targets: ", end="")
-            for t in config['targets']:
-                if t == '_io':
-                    continue
-                elif config['targets'][t]:
-                    print("%s " % t, end="")
+            for bit in range(len(TARGETS)):
+                if effect.target & (1 << bit):
+                    print("%s " % TARGETS[bit], end="")
             print("")
 
         if options.seven_bit:
             for i in range(0, 29, 7):
-                print("%2.2x " % ((config['id'] >> i) & 0x7F), end="")
+                print("%2.2x " % ((effect.id >> i) & 0x7F), end="")
             print()
 
-    if options.id and data:
-        config = zoomzt2.ZD2.parse(data)
-        print("0x%8.8x" % (config['id']))
+    if options.id and effect:
+        print("0x%8.8x" % (effect.id))
 
-    if options.version and data:
-        config = zoomzt2.ZD2.parse(data)
-        print("%s" % (config['version']))
+    if options.version and effect:
+        print("%s" % (effect.version))
+
+    if effect:
+        effect.close()
 
     if data and options.bitmap:
        outfile = open(options.bitmap, "wb")
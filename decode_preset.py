@@ -5,6 +5,7 @@
 #
 
 from construct import *
+from zoomcodec import unpack
 
 #--------------------------------------------------
 # Define ZPTC file format using Construct (v2.9)
@@ -248,26 +249,6 @@ Midi_45 = Struct(
     )
 
 
-def unpack(packet):
-    # Unpack data 7bit to 8bit, MSBs in first byte
-    data = bytearray(b"")
-    loop = -1
-    hibits = 0
-
-    for byte in packet:
-        if loop !=-1:
-            if (hibits & (2**loop)):
-                data.append(128 + byte)
-            else:
-                data.append(byte)
-            loop = loop - 1
-        else:
-            hibits = byte
-            # do we need to acount for short sets (at end of block block)?
-            loop = 6
-
-    return(data)
-
 #--------------------------------------------------
 # Convert Patches between Effects with 1 or 2screen versions
 convert = [ # 2screen -> 1screen
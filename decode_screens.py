@@ -9,7 +9,12 @@
 #                                              ^^ Stop Screen
 #                                           ^^ Start Screen
 #
+# or live from the pedal, printing parameters as they change:
+# $ python3 decode_screens.py --live
+#
 
+import sys
+import struct
 from construct import *
 
 #--------------------------------------------------
@@ -53,12 +58,77 @@ Display = Struct(
                                         # many screens worth of data
 )
 
+#--------------------------------------------------
+# Incremental decoding, for live data. Walks the same 'Info' records
+# as above (screen, param, type, invert, value) directly, as they are
+# a fixed 14 bytes, rather than parsing the whole 'Display' at once.
+
+INFO = struct.Struct("<BBBB10s")
+INFO_VALUE = 0x00
+INFO_NAME = 0x01
+INFO_INVERT = 0x07
+
+def iter_infos(data):
+    # yield (screen, param, type, invert, value) for each record
+    data = memoryview(data)
+    start = bytes(data[:32]).find(b"\x52\x00\x6e\x64\x01")
+    if start < 0:
+        return
+    for offset in range(start + 5, len(data) - INFO.size + 1, INFO.size):
+        screen, param, type, invert, value = INFO.unpack_from(data, offset)
+        yield (screen, param, type, invert, \
+                value.rstrip(b"\x00").decode("ascii", "replace"))
+
+class ScreenState(object):
+    # last known name/value of each (screen, param), so that only
+    # changes are reported from each new dump
+    def __init__(self):
+        self.last = None
+        self.params = {}
+
+    def update(self, data):
+        # yield (screen, param, name, value) for each changed parameter
+        if self.last == bytes(data):
+            return
+        self.last = bytes(data)
+
+        key = None
+        for screen, param, type, invert, value in iter_infos(data):
+            if (screen, param) != key:
+                if key:
+                    change = self.store(key, name, current)
+                    if change:
+                        yield change
+                key = (screen, param)
+                name = None
+                current = None
+
+            if type == INFO_NAME:
+                name = value
+            else:
+                current = value
+        if key:
+            change = self.store(key, name, current)
+            if change:
+                yield change
+
+    def store(self, key, name, value):
+        (oldname, oldvalue) = self.params.get(key, (None, None))
+        if name == None:
+            name = oldname
+        if value == None:
+            value = oldvalue
+        if (name, value) == (oldname, oldvalue):
+            return(None)
+        self.params[key] = (name, value)
+        return(key[0], key[1], name, value)
+
 #--------------------------------------------------
 def main():
     from argparse import ArgumentParser
 
     parser = ArgumentParser(prog="decode_effect")
-    parser.add_argument('files', metavar='FILE', nargs=1,
+    parser.add_argument('files', metavar='FILE', nargs='?',
         help='File to process')
 
     parser.add_argument("-d", "--dump",
@@ -69,13 +139,27 @@ def main():
         help="display all parameters (include 'Dummy')",
         action="store_true", dest="all")
 
+    parser.add_argument("-l", "--live",
+        help="read screens from attached pedal, printing parameters as they change",
+        action="store_true", dest="live")
+    parser.add_argument("-i", "--interval",
+        type=float, default=0.1, dest="interval",
+        help="With --live, seconds between screen requests (default 0.1)")
+    parser.add_argument("-M", "--midiskip",
+        type=int, default=0, dest="midiskip",
+        help="Skip devices when connecting, ie when you have multiple pedals")
+
     options = parser.parse_args()
 
-    if not len(options.files):
+    if options.live:
+        live(options)
+        sys.exit()
+
+    if not options.files:
         parser.error("FILE not specified")
 
     # Read data from file
-    infile = open(options.files[0], "rb")
+    infile = open(options.files, "rb")
     if not infile:
         sys.exit("Unable to open FILE for reading")
     else:
@@ -111,6 +195,32 @@ def main():
         if config['end'] == None:
             print("\nWarning: data not complete!")
 
+def live(options):
+    import zoomzt2
+    from time import sleep
+
+    pedal = zoomzt2.zoomzt2()
+    if not pedal.connect(options.midiskip):
+        sys.exit("Unable to find Pedal")
+    pedal.editor_on()
+
+    def changed(screen, param, name, value):
+        if value != "Dummy" or options.all:
+            if name:
+                print("Screen %d, param %d: %s : %s" % (screen, param, name, value))
+            else:
+                print("Screen %d, param %d: %s" % (screen, param, value))
+
+    listener = pedal.screen_listen(changed, interval = options.interval)
+    try:
+        while listener.thread.is_alive():
+            sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    listener.stop()
+    pedal.editor_off()
+    pedal.disconnect()
+
 
 if __name__ == "__main__":
     main()
@@ -61,7 +61,7 @@ def main():
             options.zt2 = None
         else:
             data = infile.read()
-            zt2 = zoomzt2.ZT2.parse(data)
+            zt2 = zoomzt2.zt2_parse(data)
 
             # scan through effects remembering Ids and Effect names
             for group in zt2[1]:
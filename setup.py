@@ -10,7 +10,7 @@ setup(
     license = "GPLv3",
     keywords = "Zoom Pedal",
     url = "https://github.com/mungewell/zoom-zt2",
-    py_modules=["zoomzt2"],
+    py_modules=["zoomzt2", "zoomcodec", "zoomemu", "zoomtransport", "zoomasync", "decode_screens"],
     long_description=open("README.rst").read() if isfile("README.rst") else "",
     classifiers=[
         "Development Status :: 4 - Beta",
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+#
+# Check the shared 7bit SysEx codec against a byte at a time version,
+# including the short group at the end of a block
+#
+
+import os
+import sys
+import random
+import binascii
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import zoomcodec
+
+# every length of short trailing group (0..6), with and without full groups
+LENGTHS = list(range(0, 22)) + [510, 511, 512, 4095, 4096]
+
+
+def reference_pack(data):
+    # MSBs of each group of upto 7 bytes, first byte in bit 6
+    packet = bytearray()
+    for start in range(0, len(data), 7):
+        group = data[start:start + 7]
+        hibits = 0
+        for n in range(len(group)):
+            hibits |= (group[n] & 0x80) >> (n + 1)
+        packet.append(hibits)
+        packet.extend(byte & 0x7f for byte in group)
+    return(packet)
+
+def sample(length, seed):
+    random.seed(seed)
+    return(bytes(random.randrange(256) for x in range(length)))
+
+@pytest.mark.parametrize("length", LENGTHS)
+def test_pack(length):
+    data = sample(length, length)
+    packet = zoomcodec.pack(data)
+    assert packet == reference_pack(data)
+    assert max(packet, default=0) < 0x80
+
+@pytest.mark.parametrize("length", LENGTHS)
+def test_round_trip(length):
+    data = sample(length, length)
+    assert zoomcodec.unpack(zoomcodec.pack(data)) == data
+
+@pytest.mark.parametrize("byte", [0x00, 0x7f, 0x80, 0xff])
+def test_msb_positions(byte):
+    # each position of a full group, and of every short trailing group
+    for length in range(1, 15):
+        for position in range(length):
+            data = bytearray(length)
+            data[position] = byte
+            assert zoomcodec.pack(data) == reference_pack(data)
+            assert zoomcodec.unpack(zoomcodec.pack(data)) == data
+
+def test_unpack_header_only():
+    # trailing group with only its MSB byte carries no data
+    assert zoomcodec.unpack(b"") == b""
+    assert zoomcodec.unpack(b"\x40") == b""
+    assert zoomcodec.unpack(reference_pack(b"\xff" * 7) + b"\x00") == b"\xff" * 7
+
+@pytest.mark.parametrize("length", [0, 1, 7, 100, 4096])
+def test_checksum(length):
+    data = sample(length, length)
+    encoded = zoomcodec.checksum(data)
+    assert len(encoded) == 5
+    assert max(encoded) < 0x80
+    assert zoomcodec.checksum_value(b"\x01\x02" + encoded) == binascii.crc32(data)
+
+def test_checksum_detects_change():
+    data = bytearray(sample(512, 1))
+    encoded = zoomcodec.checksum(data)
+    data[100] ^= 0x01
+    assert zoomcodec.checksum_value(encoded) != binascii.crc32(data)
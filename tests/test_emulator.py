@@ -0,0 +1,200 @@
+#!/usr/bin/python
+#
+# Round trips through the virtual pedal: files, patches, retries on a
+# noisy or lossy link, and the sync/restore helpers built on them
+#
+
+import os
+import sys
+import random
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import zoomzt2
+import zoomemu
+import zoomtransport
+
+
+def read(name):
+    infile = open(name, "rb")
+    data = infile.read()
+    infile.close()
+    return(data)
+
+def write(name, data):
+    outfile = open(name, "wb")
+    outfile.write(data)
+    outfile.close()
+
+def effect(version, id, size=1000):
+    # enough of a ZD2 for zd2_header(), followed by filler
+    return(zoomzt2.ZD2_HEADER.pack(b"ZDLF", version.encode("ascii"), b"\x00\x00",
+            id >> 24, id) + os.urandom(size))
+
+def connect(emu):
+    pedal = zoomzt2.zoomzt2()
+    emu.attach(pedal)
+    pedal.pcmode_on()
+    return(pedal)
+
+@pytest.fixture
+def emu():
+    emu = zoomemu.VirtualPedal(patches=20)
+    emu.files["FLST_SEQ.ZT2"] = bytearray(read(os.path.join(ROOT, "EMPTY.ZT2")))
+    return(emu)
+
+@pytest.mark.parametrize("size", [0, 1, 511, 512, 513, 5000])
+@pytest.mark.parametrize("window", [1, 4])
+def test_file_round_trip(emu, size, window):
+    pedal = connect(emu)
+    data = os.urandom(size)
+    pedal.file_upload("TEST.ZD2", data, window)
+    pedal.file_close()
+    assert bytes(emu.files["TEST.ZD2"]) == data
+
+    assert pedal.file_check("TEST.ZD2")
+    assert bytes(pedal.file_download("TEST.ZD2")) == data
+    pedal.file_close()
+    assert pedal.file_size("TEST.ZD2") == size
+    pedal.disconnect()
+
+def test_file_list(emu):
+    emu.files["A.ZD2"] = bytearray(b"a" * 10)
+    emu.files["B.ZIC"] = bytearray(b"b" * 20)
+    pedal = connect(emu)
+    assert sorted(pedal.file_list()) == ["A.ZD2", "B.ZIC", "FLST_SEQ.ZT2"]
+    assert not pedal.file_check("MISSING.ZD2")
+
+    pedal.file_delete("A.ZD2")
+    pedal.file_close()
+    assert "A.ZD2" not in emu.files
+    pedal.disconnect()
+
+@pytest.mark.parametrize("window", [1, 4])
+def test_patch_round_trip(emu, window):
+    pedal = connect(emu)
+    (count, psize, bsize) = pedal.patch_check()
+    assert count == 20
+
+    data = b"PTCF" + os.urandom(psize - 4)
+    pedal.patch_upload(12, data)
+    assert emu.patches[11] == data
+    assert pedal.patch_download(12) == data
+
+    emu.patches = [os.urandom(psize) for x in range(count)]
+    patches = list(pedal.patch_download_all(False, window))
+    assert [location for location, data in patches] == list(range(1, count + 1))
+    assert [data for location, data in patches] == emu.patches
+    pedal.disconnect()
+
+def test_patch_round_trip_old(emu):
+    pedal = connect(emu)
+    pedal.patch_upload_old(3, b"xyz")
+    assert pedal.patch_download_old(3) == b"xyz"
+    pedal.disconnect()
+
+@pytest.mark.parametrize("window", [1, 4])
+def test_noisy_link(capsys, window):
+    # corrupted blocks are requested again, rather than saved or raised
+    random.seed(window)
+    emu = zoomemu.VirtualPedal(patches=20, noise=0.1)
+    emu.files["BIG.ZD2"] = bytearray(os.urandom(20000))
+    emu.patches = [os.urandom(760) for x in range(20)]
+    pedal = connect(emu)
+
+    assert bytes(pedal.file_download("BIG.ZD2")) == bytes(emu.files["BIG.ZD2"])
+    pedal.file_close()
+    assert pedal.retry_count["BIG.ZD2"] > 0
+
+    # failed patches are fetched again after the rest
+    patches = dict(pedal.patch_download_all(False, window))
+    assert [patches[location] for location in range(1, 21)] == emu.patches
+    assert "Checksum error on patch" in capsys.readouterr().out
+    pedal.disconnect()
+
+def lossy(emu, drop):
+    # transport which loses the replies to the next 'drop[0]' messages
+    def handler(message):
+        replies = emu.process(message)
+        if drop[0] > 0:
+            drop[0] = drop[0] - 1
+            return([])
+        return(replies)
+    return(zoomtransport.LoopbackTransport(handler))
+
+@pytest.mark.parametrize("dispatch", [False, True])
+def test_retry_lost_replies(emu, dispatch):
+    drop = [0]
+    pedal = zoomzt2.zoomzt2()
+    pedal.attach(lossy(emu, drop))
+    if dispatch:
+        pedal.dispatch()
+    pedal.policy = zoomzt2.RetryPolicy(timeout=0.05, retries=2, backoff=0.01)
+    pedal.pcmode_on()
+
+    drop[0] = 2
+    assert pedal.file_check("FLST_SEQ.ZT2")
+
+    drop[0] = 3
+    with pytest.raises(zoomzt2.ReplyTimeout) as error:
+        pedal.patch_check()
+    assert error.value.attempts == 3
+
+    drop[0] = 0
+    assert pedal.patch_check()[0] == 20
+    pedal.disconnect()
+
+def test_sync(emu, tmp_path):
+    dirname = str(tmp_path)
+    write(os.path.join(dirname, "ONE.ZD2"), effect("1.00", 0x01000010))
+    write(os.path.join(dirname, "ONE.ZIC"), os.urandom(100))
+    emu.files["OLD.ZD2"] = bytearray(effect("1.00", 0x09000001))
+    pedal = connect(emu)
+    manifest = zoomzt2.Manifest(os.path.join(dirname, "zoomzt2.manifest"))
+
+    assert zoomzt2.sync_files(pedal, dirname, manifest) == (2, 0, 0)
+    assert bytes(emu.files["ONE.ZD2"]) == read(os.path.join(dirname, "ONE.ZD2"))
+    assert zoomzt2.FlstSession(pedal).find("ONE.ZD2")['id'] == 0x01000010
+
+    # unchanged files are not sent again
+    manifest = zoomzt2.Manifest(manifest.path)
+    manifest.load()
+    assert zoomzt2.sync_files(pedal, dirname, manifest) == (0, 2, 0)
+
+    # nor are changes on the pedal missed, once listed again
+    emu.files["ONE.ZIC"] = bytearray(b"edited")
+    pedal.file_refresh()
+    write(os.path.join(dirname, "ONE.ZD2"), effect("1.10", 0x01000010))
+    assert zoomzt2.sync_files(pedal, dirname, manifest, True) == (2, 0, 1)
+    assert "OLD.ZD2" not in emu.files
+    assert bytes(emu.files["ONE.ZIC"]) == read(os.path.join(dirname, "ONE.ZIC"))
+    assert zoomzt2.FlstSession(pedal).find("ONE.ZD2")['version'] == "1.10"
+    pedal.disconnect()
+
+@pytest.mark.parametrize("old", [False, True])
+def test_restore(emu, tmp_path, old):
+    emu.patches = [os.urandom(760) for x in range(20)]
+    pedal = connect(emu)
+    archive = os.path.join(str(tmp_path), "backup.zip")
+    manifest = zoomzt2.Manifest(os.path.join(str(tmp_path), "patches.manifest"))
+    assert zoomzt2.save_all_patches(pedal, archive, old, 4, manifest) == 20
+    saved = list(emu.patches)
+
+    emu.patches[5] = os.urandom(760)
+    emu.patches[9] = os.urandom(760)
+    (uploaded, skipped, size, downloaded) = zoomzt2.restore_patches(pedal,
+            archive, None, old)
+    assert (uploaded, skipped, downloaded) == (2, 18, 20)
+    assert emu.patches == saved
+
+    # trusting the manifest misses edits made on the pedal
+    emu.patches[3] = os.urandom(760)
+    manifest.load()
+    assert zoomzt2.restore_patches(pedal, archive, manifest, old, 1, True)[:2] == (0, 20)
+    assert emu.patches[3] != saved[3]
+    assert zoomzt2.restore_patches(pedal, archive, manifest, old)[:2] == (1, 19)
+    assert emu.patches == saved
+    pedal.disconnect()
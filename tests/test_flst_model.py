@@ -0,0 +1,188 @@
+#!/usr/bin/python
+#
+# Check the indexed FLST_SEQ model: edits against the construct
+# definition, --apply lists (as the shipped scripts) and --from-dir
+#
+
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import zoomzt2
+
+SCRIPTS = ["G1_everything", "G3_G5_everything"]
+
+
+def read(name):
+    infile = open(name, "rb")
+    data = infile.read()
+    infile.close()
+    return(data)
+
+def write(name, data):
+    outfile = open(name, "wb")
+    outfile.write(data)
+    outfile.close()
+
+def effect(version, id):
+    # enough of a ZD2 for zd2_header()
+    return(zoomzt2.ZD2_HEADER.pack(b"ZDLF", version.encode("ascii"), b"\x00\x00",
+            id >> 24, id) + bytes(100))
+
+def listed(data):
+    # (group, [(name, version, installed, id)...]) as parsed by construct
+    return([(group['group'], [(effect['effect'], effect['version'], effect['installed'],
+            effect['id']) for effect in group['effects']])
+            for group in zoomzt2.ZT2.parse(data)[1]])
+
+@pytest.fixture
+def empty():
+    return(read(os.path.join(ROOT, "EMPTY.ZT2")))
+
+def test_empty(empty):
+    assert zoomzt2.zt2_build(zoomzt2.zt2_empty()) == empty
+
+def test_add(empty):
+    model = zoomzt2.FlstModel(empty)
+    model.add("B.ZD2", "1.00", 0x01000020)
+    model.add("A.ZD2", "1.10", 0x01000010, False)
+    model.add("path/R.ZD2", "1.00", 0x0c000001)
+    assert model.find("A.ZD2")['version'] == "1.10"
+    assert model.find_id(0x01000020)['effect'] == "B.ZD2"
+
+    groups = dict(listed(model.data()))
+    assert groups[1] == [("B.ZD2", "1.00", 1, 0x01000020), ("A.ZD2", "1.10", 0, 0x01000010)]
+    # new group, after those already listed
+    assert groups[12] == [("R.ZD2", "1.00", 1, 0x0c000001)]
+    assert listed(model.data())[-1][0] == 12
+
+    # adding again replaces, at the end of the group
+    model.add("B.ZD2", "1.20", 0x01000020)
+    assert dict(listed(model.data()))[1] == [("A.ZD2", "1.10", 0, 0x01000010),
+            ("B.ZD2", "1.20", 1, 0x01000020)]
+
+def test_remove(empty):
+    model = zoomzt2.FlstModel(empty)
+    model.add("A.ZD2", "1.00", 0x01000010)
+    model.add("B.ZD2", "1.00", 0x01000020)
+    assert model.remove("A.ZD2")
+    assert not model.remove("A.ZD2")
+    assert model.find("A.ZD2") == None
+    assert model.find_id(0x01000010) == None
+    assert dict(listed(model.data()))[1] == [("B.ZD2", "1.00", 1, 0x01000020)]
+
+    assert model.remove("B.ZD2")
+    assert model.data() == empty
+
+def test_toggle(empty):
+    model = zoomzt2.FlstModel(empty)
+    model.add("A.ZD2", "1.00", 0x01000010)
+    assert model.toggle("A.ZD2") == 0
+    assert dict(listed(model.data()))[1] == [("A.ZD2", "1.00", 0, 0x01000010)]
+    assert model.toggle("A.ZD2") == 1
+    assert model.toggle("MISSING.ZD2") == None
+
+def test_move_and_sort(empty):
+    model = zoomzt2.FlstModel(empty)
+    for name, id in (("A.ZD2", 0x01000010), ("C.ZD2", 0x01000030), ("B.ZD2", 0x01000020)):
+        model.add(name, "1.00", id)
+    model.move("A.ZD2")
+    assert [effect[0] for effect in dict(listed(model.data()))[1]] == \
+            ["C.ZD2", "B.ZD2", "A.ZD2"]
+    model.move("B.ZD2", False)
+    assert [effect[0] for effect in dict(listed(model.data()))[1]] == \
+            ["B.ZD2", "C.ZD2", "A.ZD2"]
+    model.sort()
+    assert [effect[0] for effect in dict(listed(model.data()))[1]] == \
+            ["A.ZD2", "B.ZD2", "C.ZD2"]
+
+def test_duplicate(empty):
+    # an effect listed twice is refused, rather than one entry lost
+    config = zoomzt2.zt2_parse(empty)
+    model = zoomzt2.FlstModel()
+    model.index(config)
+    model.add("A.ZD2", "1.00", 0x01000010)
+    model.sync()
+    config[1][0]['effects'].append(config[1][0]['effects'][0])
+    with pytest.raises(ValueError):
+        zoomzt2.FlstModel(zoomzt2.zt2_build(config))
+
+@pytest.mark.parametrize("script", SCRIPTS)
+def test_apply_script(empty, script):
+    # the shipped lists rebuild the shipped configs
+    model = zoomzt2.FlstModel(empty)
+    model.apply(zoomzt2.read_operations(os.path.join(ROOT, "scripts", script + ".sh")))
+    assert model.data() == read(os.path.join(ROOT, "scripts", script + ".zt2"))
+
+def test_apply_formats(empty, tmp_path):
+    text = os.path.join(str(tmp_path), "ops.txt")
+    write(text, b"# comment\n"
+            b"add A.ZD2 1.00 0x01000010\n"
+            b"not-add B.ZD2 1.10 16777248\n"
+            b"toggle A.ZD2\n"
+            b"delete B.ZD2\n")
+    operations = zoomzt2.read_operations(text)
+    assert operations == [("add", "A.ZD2", "1.00", 0x01000010, True),
+            ("add", "B.ZD2", "1.10", 0x01000020, False),
+            ("toggle", "A.ZD2"), ("delete", "B.ZD2")]
+
+    entries = [dict(op="add", name="A.ZD2", version="1.00", id="0x01000010"),
+            dict(op="not-add", name="B.ZD2", version="1.10", id=0x01000020),
+            dict(op="toggle", name="A.ZD2"), dict(op="delete", name="B.ZD2")]
+    write(text, json.dumps(entries).encode("ascii"))
+    assert zoomzt2.read_operations(text) == operations
+
+    write(text, b"add A.ZD2 1.00\n")
+    with pytest.raises(ValueError):
+        zoomzt2.read_operations(text)
+
+def run(*arguments):
+    return(subprocess.run([sys.executable, os.path.join(ROOT, "zoomzt2.py")] + \
+            list(arguments), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True))
+
+def test_apply_command(empty, tmp_path):
+    filename = os.path.join(str(tmp_path), "G1_everything.zt2")
+    write(filename, empty)
+    result = run("--apply", os.path.join(ROOT, "scripts", "G1_everything.sh"), "-w", filename)
+    assert result.returncode == 0, result.stdout
+    assert read(filename) == read(os.path.join(ROOT, "scripts", "G1_everything.zt2"))
+
+    # and back again, from the --build output
+    script = os.path.join(str(tmp_path), "G1.sh")
+    result = run("--build", "G1.zt2", filename)
+    write(script, result.stdout.encode("ascii"))
+    write(filename, empty)
+    assert run("--apply", script, "-w", filename).returncode == 0
+    assert read(filename) == read(os.path.join(ROOT, "scripts", "G1_everything.zt2"))
+
+def test_from_dir(tmp_path):
+    dirname = os.path.join(str(tmp_path), "effects")
+    os.mkdir(dirname)
+    write(os.path.join(dirname, "B.ZD2"), effect("1.00", 0x01000020))
+    write(os.path.join(dirname, "a.zd2"), effect("1.00", 0x01000010))
+    write(os.path.join(dirname, "1234567"), effect("1.10", 0x03000005))
+    write(os.path.join(dirname, "notes.txt"), b"not an effect")
+    write(os.path.join(dirname, "BAD.ZD2"), b"ZDLF")
+
+    # a new config, from nothing but the directory
+    filename = os.path.join(str(tmp_path), "FLST_SEQ.ZT2")
+    result = run("--from-dir", dirname, "-w", filename)
+    assert result.returncode == 0, result.stdout
+    assert "BAD.ZD2" in result.stdout and "notes.txt" not in result.stdout
+    groups = dict(listed(read(filename)))
+    assert groups[1] == [("a.zd2", "1.00", 1, 0x01000010), ("B.ZD2", "1.00", 1, 0x01000020)]
+    assert groups[3] == [("1234567", "1.10", 1, 0x03000005)]
+
+    # entries already listed are sorted with those added
+    session = zoomzt2.FlstSession(None, read(filename))
+    session.add("Z.ZD2", "1.00", 0x01000001)
+    session.add_from_dir(dirname)
+    assert [effect[0] for effect in dict(listed(session.data()))[1]] == \
+            ["Z.ZD2", "a.zd2", "B.ZD2"]
@@ -0,0 +1,148 @@
+#!/usr/bin/python
+#
+# Check the in memory transports: loopback (with late replies held back
+# for the next receive), recording and deterministic replay
+#
+
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import zoomzt2
+import zoomemu
+import zoomtransport
+
+
+def test_loopback_echo():
+    transport = zoomtransport.LoopbackTransport()
+    assert transport.request(b"\xf0\x01\xf7", 0.1) == b"\xf0\x01\xf7"
+    assert transport.receive(0.01) == None
+
+def test_loopback_handler():
+    transport = zoomtransport.LoopbackTransport(lambda message: [message, b"\xf0\x02\xf7"])
+    transport.send(b"\xf0\x01\xf7")
+    assert list(transport.stream(0.01)) == [b"\xf0\x01\xf7", b"\xf0\x02\xf7"]
+
+def test_loopback_receiver():
+    received = []
+    transport = zoomtransport.LoopbackTransport(latency=0.05)
+    transport.set_receiver(lambda message, delay: received.append((message, delay)))
+    transport.send(b"\xf0\x01\xf7")
+    assert received == [(b"\xf0\x01\xf7", 0.05)]
+
+def test_loopback_held():
+    # a reply not due before the timeout is kept for the next receive,
+    # not dropped and not returned early
+    transport = zoomtransport.LoopbackTransport(latency=0.2)
+    transport.send(b"\xf0\x01\xf7")
+    assert transport.receive(0.01) == None
+    assert transport.held != None
+    assert transport.receive(1.0) == b"\xf0\x01\xf7"
+    assert transport.held == None
+
+def test_midi_parser():
+    parser = zoomtransport.MidiParser()
+    assert parser.feed(b"\xf0\x52\x00") == []
+    assert parser.feed(b"\xf8\x6e\xf7\xb0\x62\x03\x63") == \
+            [b"\xf0\x52\x00\x6e\xf7", b"\xb0\x62\x03"]
+    # running status
+    assert parser.feed(b"\x08") == [b"\xb0\x63\x08"]
+
+def late_pedal(emu, late):
+    # transport whose replies to file status requests (0x60 0x25) arrive
+    # 'late[0]' times after the requester has given up on them
+    def handler(message):
+        replies = emu.process(message)
+        if late[0] and message[4] == 0x60 and message[5] == 0x25:
+            late[0] = late[0] - 1
+            timer = threading.Timer(0.15, lambda: [transport.deliver(reply) \
+                    for reply in replies])
+            timer.start()
+            return([])
+        return(replies)
+    transport = zoomtransport.LoopbackTransport(handler)
+    return(transport)
+
+@pytest.mark.parametrize("dispatch", [False, True])
+def test_late_reply(dispatch):
+    # a late reply is not taken as the answer to a later request
+    emu = zoomemu.VirtualPedal()
+    emu.files["A.ZD2"] = bytearray(b"a" * 100)
+    emu.files["B.ZD2"] = bytearray(b"b" * 200)
+    late = [0]
+    pedal = zoomzt2.zoomzt2()
+    pedal.attach(late_pedal(emu, late))
+    if dispatch:
+        pedal.dispatch()
+    pedal.policy = zoomzt2.RetryPolicy(timeout=0.1, retries=2, backoff=0.01)
+    pedal.pcmode_on()
+
+    late[0] = 1
+    assert pedal.file_size("A.ZD2") == 100
+    assert pedal.file_size("B.ZD2") == 200
+    assert pedal.file_size("C.ZD2") == None
+    assert pedal.file_size("A.ZD2") == 100
+    pedal.disconnect()
+
+def session(pedal):
+    names = pedal.file_list()
+    data = bytes(pedal.file_download("A.ZD2"))
+    pedal.file_close()
+    return(names, data, bytes(pedal.patch_download(3)))
+
+@pytest.fixture
+def capture(tmp_path):
+    # record a session with the virtual pedal, returning its results
+    filename = os.path.join(str(tmp_path), "session.cap")
+    emu = zoomemu.VirtualPedal(latency=0.001)
+    emu.files["A.ZD2"] = bytearray(os.urandom(3000))
+    emu.patches[2] = os.urandom(760)
+
+    pedal = zoomzt2.zoomzt2()
+    pedal.attach(zoomtransport.RecordingTransport(emu.transport(), filename))
+    pedal.pcmode_on()
+    result = session(pedal)
+    pedal.disconnect()
+    return(filename, result)
+
+def test_read_capture(capture):
+    filename, result = capture
+    records = zoomtransport.read_capture(filename)
+    directions = [record[0] for record in records]
+    assert directions[0] == zoomtransport.SENT
+    assert zoomtransport.RECEIVED in directions
+    assert [record[1] for record in records] == sorted(record[1] for record in records)
+
+@pytest.mark.parametrize("speed", [0, 10])
+def test_replay(capture, speed):
+    filename, result = capture
+    transport = zoomtransport.ReplayTransport(filename, speed)
+    pedal = zoomzt2.zoomzt2()
+    pedal.attach(transport)
+    pedal.pcmode_on()
+    assert session(pedal) == result
+    pedal.disconnect()
+    assert transport.mismatches == 0
+
+def test_replay_mismatch(capture):
+    # requests differing from the capture are counted, those past its
+    # end are not answered
+    filename, result = capture
+    transport = zoomtransport.ReplayTransport(filename)
+    pedal = zoomzt2.zoomzt2()
+    pedal.attach(transport)
+    pedal.policy = zoomzt2.RetryPolicy(timeout=0.05, retries=0)
+    pedal.pcmode_on()
+    pedal.file_check("OTHER.ZD2")
+    mismatches = transport.mismatches
+    assert mismatches > 0
+
+    transport.position = len(transport.records)
+    with pytest.raises(zoomzt2.ReplyTimeout):
+        pedal.patch_check()
+    assert transport.mismatches == mismatches + 1
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+#
+# Check the fast FLST_SEQ (ZT2) codec against the construct definition,
+# on the shipped files and after editing each of their groups
+#
+
+import os
+import sys
+import glob
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import zoomzt2
+
+FILES = [os.path.join(ROOT, "EMPTY.ZT2")] + \
+        sorted(glob.glob(os.path.join(ROOT, "scripts", "*.zt2")))
+
+
+def read(name):
+    infile = open(name, "rb")
+    data = infile.read()
+    infile.close()
+    return(data)
+
+@pytest.fixture(params=FILES, ids=os.path.basename)
+def data(request):
+    return(read(request.param))
+
+def test_parse(data):
+    assert zoomzt2._zt2_parse(data) == zoomzt2.ZT2.parse(data)
+
+def test_build(data):
+    config = zoomzt2.ZT2.parse(data)
+    assert zoomzt2._zt2_build(config) == zoomzt2.ZT2.build(config)
+    assert zoomzt2.zt2_build(zoomzt2.zt2_parse(data)) == data
+
+def test_edits(data):
+    config = zoomzt2.ZT2.parse(data)
+    model = zoomzt2.FlstModel()
+    model.index(config)
+
+    for group in list(config[1]):
+        if group['effects']:
+            model.toggle(group['effects'][0]['effect'])
+            model.move(group['effects'][0]['effect'])
+            model.remove(group['effects'][-1]['effect'])
+        model.add("CHECK.ZD2", "1.00", (group['group'] << 24) + 0x7f)
+        model.sync()
+
+        built = zoomzt2.ZT2.build(config)
+        assert zoomzt2._zt2_build(config) == built, "group %d" % group['group']
+        assert zoomzt2._zt2_parse(built) == zoomzt2.ZT2.parse(built), \
+                "group %d" % group['group']
@@ -5,8 +5,6 @@
 #
 
 import wx
-import time
-import _thread
 import wx.lib.agw.pygauge as PG
 
 import zoomzt2
@@ -23,6 +21,7 @@ global options
 
 class MyFrame(wx.Frame):
     pedal = None
+    listener = None
 
     def __init__(self, *args, **kwds):
         # begin wxGlade: MyFrame.__init__
@@ -95,36 +94,32 @@ class MyFrame(wx.Frame):
         self.UpdateButtons()
         event.Skip()
 
-    def doTuner(self):
-        while self.pedal.is_connected():
-            (note, delta) = self.pedal.tuner_read()
-            if note:
-                wx.CallAfter(self.label_1.SetLabel, note)
-
-                wx.CallAfter(self.gauge_1.SetValue, 10)
-                wx.CallAfter(self.gauge_2.SetValue, 0)
-                if delta == 0:
-                    # perfect tuning, show Green Bar
-                    wx.CallAfter(self.gauge_1.SetValue, 0)
-                    wx.CallAfter(self.gauge_2.SetValue, 10)
-                    wx.CallAfter(self.gauge_1.SetBackgroundColour, wx.GREEN)
-                    wx.CallAfter(self.gauge_2.SetBarColor, wx.GREEN)
-                else:
-                    wx.CallAfter(self.gauge_1.SetBackgroundColour, wx.BLUE)
-                    wx.CallAfter(self.gauge_2.SetBarColor, wx.RED)
-
-                    if note != "-":
-                        if delta < 0:
-                            wx.CallAfter(self.gauge_1.SetValue, delta+10)
-                        if delta > 0:
-                            wx.CallAfter(self.gauge_2.SetValue, delta)
-
-                wx.CallAfter(self.Layout)
-                wx.CallAfter(self.Refresh)
-
-            time.sleep(0.1)
-
-        wx.CallAfter(self.DisconnectPedal)
+    def doTuner(self, note, delta):
+        # called by the pedal's tuner listener, with latest reading
+        if not note:
+            return
+        wx.CallAfter(self.label_1.SetLabel, note)
+
+        wx.CallAfter(self.gauge_1.SetValue, 10)
+        wx.CallAfter(self.gauge_2.SetValue, 0)
+        if delta == 0:
+            # perfect tuning, show Green Bar
+            wx.CallAfter(self.gauge_1.SetValue, 0)
+            wx.CallAfter(self.gauge_2.SetValue, 10)
+            wx.CallAfter(self.gauge_1.SetBackgroundColour, wx.GREEN)
+            wx.CallAfter(self.gauge_2.SetBarColor, wx.GREEN)
+        else:
+            wx.CallAfter(self.gauge_1.SetBackgroundColour, wx.BLUE)
+            wx.CallAfter(self.gauge_2.SetBarColor, wx.RED)
+
+            if note != "-":
+                if delta < 0:
+                    wx.CallAfter(self.gauge_1.SetValue, delta+10)
+                if delta > 0:
+                    wx.CallAfter(self.gauge_2.SetValue, delta)
+
+        wx.CallAfter(self.Layout)
+        wx.CallAfter(self.Refresh)
 
     def UpdateButtons(self):
         if self.pedal.is_connected():
@@ -142,11 +137,12 @@ class MyFrame(wx.Frame):
         if self.pedal.connect(options.midiskip):
             self.pedal.editor_on()
             self.pedal.tuner(True)
-            _thread.start_new_thread(self.doTuner, ())
+            self.listener = self.pedal.tuner_listen(self.doTuner)
         self.UpdateButtons()
 
     def DisconnectPedal(self):
         if self.pedal.is_connected():
+            self.listener.stop()
             self.pedal.tuner(False)
             self.pedal.editor_off()
             self.pedal.disconnect()
@@ -21,11 +21,13 @@ parser.add_argument("-t", "--tuner",
 parser.add_argument("-M", "--midiskip",
     type=int, default=0, dest="midiskip",
     help="Skip devices when connecting, ie when you have multiple pedals")
+parser.add_argument("-r", "--record", dest="record",
+    help="Record session (both directions) to file RECORD")
 
 options = parser.parse_args()
 
 pedal = zoomzt2.zoomzt2()
-if not pedal.connect(options.midiskip):
+if not pedal.connect(options.midiskip, capture=options.record):
     sys.exit("Unable to find Pedal")
 else:
     print("Connected")
@@ -38,7 +40,7 @@ else:
             pedal.tuner_on_off()
 
 while(True):
-    msg = pedal.inport.receive()
-    if hasattr(msg, 'data'):
-        print(hexdump.hexdump(bytes(msg.data)))
+    message = pedal.transport.receive()
+    if message[0] == 0xf0:
+        print(hexdump.hexdump(message[1:-1]))
 
@@ -0,0 +1,326 @@
+#!/usr/bin/python
+#
+# asyncio client for the Zoom pedals
+#
+# Each AsyncPedal has a single reader task, which routes every message
+# received to the request awaiting it (matched by opcode, see
+# 'zoomzt2.is_reply') or else to the subscribers. Messages are built and
+# decoded by the same code as the blocking 'zoomzt2' class.
+#
+# Operations on one pedal are serialized (the file protocol is stateful)
+# and complete, ie. file_download() also closes the file, but any number
+# of pedals can be driven from one event loop. Replies are waited for and
+# requests repeated as the pedal's 'policy' says (see 'zoomzt2.RetryPolicy'),
+# raising 'zoomzt2.ReplyTimeout' as the blocking class does; whole
+# operations can be given a deadline with asyncio.wait_for() and are
+# cancelled as any other task.
+#
+
+import os
+import asyncio
+from time import monotonic
+
+import zoomzt2
+import zoomtransport
+
+
+class AsyncPedal(object):
+    policy = zoomzt2.RetryPolicy()
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.codec = zoomzt2.zoomzt2()      # builds/decodes messages
+        self.pending = []
+        self.candidates = {}        # future: unmatched message from pedal
+        self.subscribers = []
+        self.pcmode = False
+        self.editor = False
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.lock = asyncio.Lock()
+        self.incoming = asyncio.Queue()
+        self.reader = self.loop.create_task(self.read())
+        self.transport.set_receiver(self._received)
+
+    async def close(self):
+        # the connection is closed even if leaving PC mode fails
+        try:
+            if self.pcmode:
+                await self.pcmode_off()
+        finally:
+            self.transport.set_receiver(None)
+            self.reader.cancel()
+            self.transport.close()
+
+    def subscribe(self, callback):
+        # 'callback(message)' for messages which are not replies
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    #--------------------------------------------------
+    # message routing
+
+    def _received(self, message, delay):
+        # from the transport, possibly on another thread
+        self.loop.call_soon_threadsafe(self.incoming.put_nowait,
+                (monotonic() + delay, message))
+
+    async def read(self):
+        while True:
+            due, message = await self.incoming.get()
+            wait = due - monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.dispatch(message)
+
+    def dispatch(self, message):
+        for entry in self.pending:
+            request, future = entry
+            if zoomzt2.is_reply(request, message):
+                self.pending.remove(entry)
+                if not future.done():
+                    future.set_result(message)
+                return
+        if self.pending and zoomzt2.from_pedal(message):
+            # kept by the oldest request, in case no reply matches
+            request, future = self.pending[0]
+            if future in self.candidates:
+                zoomzt2.log_unmatched(request, message)
+            else:
+                self.candidates[future] = message
+        for subscriber in self.subscribers:
+            subscriber(message)
+
+    def submit(self, message):
+        # send request, returning future for its reply
+        future = self.loop.create_future()
+        self.pending.append((message, future))
+        self.transport.send(message)
+        return(future)
+
+    async def wait(self, future, timeout = None):
+        # SysEx data of reply, as 'zoomzt2.request()'
+        if timeout == None:
+            timeout = self.policy.timeout
+        message = None
+        for entry in self.pending:
+            if entry[1] == future:
+                message = entry[0]
+                break
+        try:
+            reply = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if future not in self.candidates:
+                raise zoomzt2.ReplyTimeout(message, timeout)
+            reply = self.candidates[future]
+            zoomzt2.log_unmatched(message, reply, True)
+        finally:
+            self.candidates.pop(future, None)
+            for entry in self.pending:
+                if entry[1] == future:
+                    self.pending.remove(entry)
+                    break
+        return(memoryview(reply)[1:-1])
+
+    async def request(self, message, policy = None):
+        if policy == None:
+            policy = self.policy
+        attempts = policy.attempts(message)
+        timeout = policy.wait(message)
+
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(policy.delay(attempt - 1))
+            try:
+                return(await self.wait(self.submit(message), timeout))
+            except zoomzt2.ReplyTimeout:
+                pass
+        raise zoomzt2.ReplyTimeout(message, timeout, attempts)
+
+    #--------------------------------------------------
+    # modes
+
+    async def pcmode_on(self):
+        async with self.lock:
+            await self.request(zoomzt2.PCMODE_ON)
+            self.pcmode = True
+
+    async def pcmode_off(self):
+        async with self.lock:
+            await self.request(zoomzt2.PCMODE_OFF)
+            self.pcmode = False
+
+    async def editor_on(self):
+        async with self.lock:
+            await self.request(zoomzt2.EDITOR_ON)
+            self.editor = True
+
+    async def editor_off(self):
+        async with self.lock:
+            await self.request(zoomzt2.EDITOR_OFF)
+            self.editor = False
+
+    #--------------------------------------------------
+    # files
+
+    async def _find(self, name):
+        packet = bytearray(b"\x52\x00\x6e\x60\x25\x00\x00")
+        found = self.codec.found_decode(await self.request(
+                self.codec.filename_message(packet, name)))
+        await self.request(zoomzt2.FILE_FIND_CLOSE)
+        return(found)
+
+    async def _close(self):
+        await self.request(zoomzt2.FILE_CLOSE)
+        await self.request(zoomzt2.FILE_FLUSH)
+
+    async def file_check(self, name):
+        async with self.lock:
+            return(await self._find(name) != None)
+
+    async def file_size(self, name):
+        # size of file on device, or None if not present
+        async with self.lock:
+            found = await self._find(name)
+        if found == None:
+            return(None)
+        return(found[1])
+
+    async def file_list(self):
+        # dict of files on device, with their sizes
+        listing = {}
+        async with self.lock:
+            packet = bytearray(b"\x52\x00\x6e\x60\x25\x00\x00")
+            while True:
+                found = self.codec.found_decode(await self.request(
+                        self.codec.filename_message(packet, "*")))
+                if found == None:
+                    break
+                listing[found[0]] = found[1]
+                packet = bytearray(b"\x52\x00\x6e\x60\x26\x00\x00")
+            await self.request(zoomzt2.FILE_FIND_CLOSE)
+            await self._close()
+        return(listing)
+
+    async def file_download(self, name):
+        async with self.lock:
+            try:
+                return(await self._download(name))
+            finally:
+                await self._close()
+
+    async def _download(self, name):
+        packet = bytearray(b"\x52\x00\x6e\x60\x20\x02\x00\x00\x00\x00\x00\x00\x00\x00\x00")
+        await self.request(self.codec.filename_message(packet, name))
+
+        data = bytearray()
+        while True:
+            await self.request(zoomzt2.FILE_STATUS)
+            await self.request(zoomzt2.FILE_READ)
+            packet = await self.request(zoomzt2.FILE_STATUS)
+
+            attempt = 0
+            while True:
+                block, retry = self.codec.block_verify(packet,
+                        os.path.basename(name), attempt)
+                if not retry:
+                    break
+                attempt = attempt + 1
+                packet = await self.request(zoomzt2.FILE_STATUS)
+
+            if block == None:
+                return(data)
+            data += block
+
+    async def file_upload(self, name, data, window = 1):
+        # 'window' blocks are kept in flight
+        async with self.lock:
+            try:
+                await self._upload(name, data, window)
+            finally:
+                await self._close()
+
+    async def _upload(self, name, data, window):
+        # delete first, as opening for write appends
+        packet = bytearray(b"\x52\x00\x6e\x60\x24")
+        await self.request(self.codec.filename_message(packet, name))
+        packet = bytearray(b"\x52\x00\x6e\x60\x20\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00")
+        await self.request(self.codec.filename_message(packet, name))
+        await self.request(zoomzt2.FILE_STATUS)
+
+        view = memoryview(data)
+        inflight = []
+        try:
+            for offset in range(0, len(view), 512):
+                if window > 1:
+                    inflight.append(self.submit(self.codec.file_block(view[offset:offset + 512])))
+                    if len(inflight) < window:
+                        continue
+                    reply = await self.wait(inflight.pop(0))
+                else:
+                    await self.request(self.codec.file_block(view[offset:offset + 512]))
+                    reply = await self.request(zoomzt2.FILE_STATUS)
+
+                if bytes(reply[-5:]) != b"\x00\x00\x00\x00\x00":
+                    raise IOError("Block at offset %d of \"%s\" was rejected" \
+                            % (offset, name))
+
+            while inflight:
+                reply = await self.wait(inflight.pop(0))
+                if bytes(reply[-5:]) != b"\x00\x00\x00\x00\x00":
+                    raise IOError("Block of \"%s\" was rejected" % name)
+        finally:
+            for future in inflight:
+                future.cancel()
+        await self.request(zoomzt2.FILE_STATUS)
+
+    async def file_delete(self, name):
+        async with self.lock:
+            packet = bytearray(b"\x52\x00\x6e\x60\x24")
+            await self.request(self.codec.filename_message(packet, name))
+            await self._close()
+
+    async def disk_usage(self):
+        async with self.lock:
+            return(self.codec.disk_usage_decode(await self.request(zoomzt2.DISK_USAGE)))
+
+    #--------------------------------------------------
+    # patches
+
+    async def _patch_check(self):
+        return(self.codec.patch_check_decode(await self.request(zoomzt2.PATCH_CHECK)))
+
+    async def patch_check(self):
+        async with self.lock:
+            return(await self._patch_check())
+
+    async def patch_download(self, location, old = False):
+        async with self.lock:
+            (count, psize, bsize) = await self._patch_check()
+            for attempt in range(self.codec.block_retries + 1):
+                packet = await self.request(self.codec.patch_read_message(location, bsize, old))
+                data, valid = self.codec.patch_decode(packet, old)
+                if valid:
+                    return(data)
+        raise zoomzt2.ChecksumError("Checksum error on patch %d, after %d retries" \
+                % (location, self.codec.block_retries))
+
+    async def patch_upload(self, location, data, old = False):
+        async with self.lock:
+            (count, psize, bsize) = await self._patch_check()
+            await self.request(self.codec.patch_write_message(location, data, bsize, old))
+
+#--------------------------------------------------
+
+async def open_pedal(midiskip = 0, backend = "mido", capture = None):
+    # connect to pedal, returns started AsyncPedal or None if not found
+    transport = zoomtransport.open_transport(zoomzt2.midinames, midiskip,
+            backend, capture)
+    if transport == None:
+        return(None)
+    pedal = AsyncPedal(transport)
+    await pedal.start()
+    return(pedal)
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+#
+# 7bit SysEx codec shared by the Zoom scripts
+#
+# MIDI SysEx can only carry 7bit bytes, so the pedals send 8bit data in
+# groups of up to 7 bytes, preceded by a byte holding their MSBs (first
+# data byte in bit 6, seventh data byte in bit 0).
+#
+# Both directions work on whole columns of groups at once using
+# bytes.translate() and extended slices, rather than walking every byte
+# in Python. numpy is deliberately not used, as the pre-built binaries
+# exclude it.
+
+import binascii
+
+# byte with MSB cleared
+_LOW7 = bytes(b & 0x7f for b in range(256))
+
+# MSB of a data byte, moved to its position (n) in the group's header byte
+_HIBIT = [bytes(((b & 0x80) >> 7) << (6 - n) for b in range(256)) \
+        for n in range(7)]
+
+# header byte, reduced to the MSB of data byte (n) in its group
+_MSB = [bytes(0x80 if b & (0x40 >> n) else 0 for b in range(256)) \
+        for n in range(7)]
+
+
+def pack(data):
+    # Pack 8bit data into 7bit, MSB's in first byte followed
+    # by 7 bytes (bits 6..0).
+    data = bytes(data)
+    length = len(data)
+    groups = length // 7
+    full = groups * 7
+    short = length - full
+
+    packet = bytearray(groups * 8 + (short + 1 if short else 0))
+
+    if groups:
+        body = data[:full]
+        header = 0
+        for n in range(7):
+            column = body[n::7]
+            header |= int.from_bytes(column.translate(_HIBIT[n]), "little")
+            packet[n + 1:groups * 8:8] = column.translate(_LOW7)
+        packet[0:groups * 8:8] = header.to_bytes(groups, "little")
+
+    # don't forget to add last few bytes
+    if short:
+        pos = groups * 8
+        hibits = 0
+        for n in range(short):
+            byte = data[full + n]
+            hibits |= (byte & 0x80) >> (n + 1)
+            packet[pos + n + 1] = byte & 0x7f
+        packet[pos] = hibits
+
+    return(packet)
+
+def unpack(packet):
+    # Unpack data 7bit to 8bit, MSBs in first byte
+    packet = bytes(packet)
+    length = len(packet)
+    groups = length // 8
+    full = groups * 8
+    short = length - full
+
+    data = bytearray(groups * 7 + (short - 1 if short else 0))
+
+    if groups:
+        header = packet[0:full:8]
+        for n in range(7):
+            column = int.from_bytes(packet[n + 1:full:8], "little") | \
+                    int.from_bytes(header.translate(_MSB[n]), "little")
+            data[n:groups * 7:7] = column.to_bytes(groups, "little")
+
+    # short set at end of block
+    if short > 1:
+        pos = groups * 7
+        hibits = packet[full]
+        for n in range(short - 1):
+            data[pos + n] = packet[full + n + 1] | _MSB[n][hibits]
+
+    return(data)
+
+def checksum(data):
+    # CRC32 of 8bit data, as 5 bytes of 7bit (little endian)
+    crc = binascii.crc32(data) ^ 0xFFFFFFFF
+    return(bytes([crc & 0x7f, (crc >> 7) & 0x7f, (crc >> 14) & 0x7f,
+            (crc >> 21) & 0x7f, (crc >> 28) & 0x0f]))
+
+def checksum_value(packet):
+    # decode CRC from the last 5 bytes of packet
+    return((packet[-5] + (packet[-4] << 7) + (packet[-3] << 14) \
+            + (packet[-2] << 21) + ((packet[-1] & 0x0F) << 28)) ^ 0xFFFFFFFF)
@@ -0,0 +1,456 @@
+#!/usr/bin/python
+#
+# Virtual pedal, answers the SysEx requests made by 'zoomzt2.py'
+#
+# Holds a filesystem (ZD2/ZIC/ZIR/FLST_SEQ.ZT2) and a bank of patches in
+# memory, so that transfers can be exercised and timed without hardware.
+# The replies are laid out as 'zoomzt2.py' decodes them from a real pedal.
+#
+# In process:
+#   emu = zoomemu.VirtualPedal()
+#   emu.attach(pedal)            # pedal = zoomzt2.zoomzt2()
+# or
+#   pedal.attach(emu.transport())
+#
+# Or as a mido virtual port, which 'zoomzt2.py' will find as a pedal:
+# $ python3 zoomemu.py --serve --dir FILES
+#
+
+import os
+import sys
+import mido
+import binascii
+import random
+import fnmatch
+import threading
+from time import sleep, monotonic
+
+import zoomcodec
+import zoomtransport
+
+# status codes, reported in last 5 bytes of file operation replies
+STATUS_OK = 0
+STATUS_NOT_FOUND = 1
+STATUS_CHECKSUM = 2
+STATUS_FULL = 3
+STATUS_NOT_OPEN = 4
+
+def _value7(value, count=5):
+    # integer as 'count' bytes of 7bit (little endian)
+    return(bytes((value >> (7 * x)) & 0x7f for x in range(count)))
+
+def _name(packet, start):
+    # zero terminated filename
+    end = packet.index(0, start)
+    return(bytes(packet[start:end]).decode("ascii"))
+
+
+class VirtualPedal(object):
+    header = b"\x52\x00\x6e"
+    capacity = 16 * 1024 * 1024
+    latency = 0
+
+    def __init__(self, patches=50, bsize=10, psize=760, latency=0, noise=0):
+        self.files = {}
+        self.patches = [b""] * patches
+        self.current = b""
+        self.bsize = bsize
+        self.psize = psize
+        self.latency = latency
+        self.noise = noise      # chance of corrupting a data reply
+
+        self.editor = False
+        self.pcmode = False
+        self.tuner = False
+        self.screens = []       # per screen, (name, value) of 6 params
+
+        self.result = self._status(0x05, STATUS_OK)
+        self.found = []
+        self.handle = None
+        self.position = 0
+        self.lock = threading.Lock()
+
+        self.transports = []
+
+    def load(self, dirname):
+        # populate filesystem from a local directory
+        for name in sorted(os.listdir(dirname)):
+            fullname = os.path.join(dirname, name)
+            if os.path.isfile(fullname):
+                infile = open(fullname, "rb")
+                self.files[name] = bytearray(infile.read())
+                infile.close()
+
+    def set_screen(self, screen, on, effect, params=[]):
+        # show 'effect' with upto 4 (name, value) params on 'screen'
+        while len(self.screens) <= screen:
+            self.screens.append([(None, "Dummy")] * 6)
+        entries = [(None, "1" if on else "0"), (None, effect)] + list(params)
+        entries = entries + [("Dummy", "Dummy")] * (6 - len(entries))
+        with self.lock:
+            self.screens[screen] = entries
+
+    def used(self):
+        return(sum(len(data) for data in self.files.values()))
+
+    #--------------------------------------------------
+    # reply builders, returned as complete MIDI messages
+
+    def _sysex(self, payload):
+        return(b"\xf0" + self.header + bytes(payload) + b"\xf7")
+
+    def _ack(self):
+        return(self._sysex(b"\x00\x00"))
+
+    def _status(self, op, status):
+        return(self._sysex(b"\x60\x01" + bytes([op]) + _value7(status)))
+
+    def _found(self, op, name):
+        return(self._sysex(b"\x60\x04" + bytes([op]) + \
+                _value7(len(self.files[name])) + b"\x00\x00\x00" + \
+                name.encode("ascii") + b"\x00"))
+
+    def _block(self, data):
+        length = len(data)
+        return(self._sysex(b"\x60\x04\x22\x14\x2f" + \
+                bytes([length & 0x7f, (length >> 7) & 0x7f]) + \
+                zoomcodec.pack(data) + zoomcodec.checksum(data)))
+
+    #--------------------------------------------------
+    # request handlers, take SysEx data (without F0/F7)
+
+    def _file(self, packet):
+        op = packet[4]
+
+        if op == 0x05:
+            # report result of last operation
+            return([self.result])
+
+        if op == 0x25 or op == 0x26:
+            # find first/next
+            if op == 0x25:
+                pattern = _name(packet, 7)
+                self.found = [name for name in self.files \
+                        if fnmatch.fnmatch(name, pattern)]
+            if self.found:
+                name = self.found.pop(0)
+                self.result = self._status(0x05, STATUS_OK)
+                return([self._found(op, name)])
+            self.result = self._status(0x05, STATUS_NOT_FOUND)
+            return([self._status(op, STATUS_NOT_FOUND)])
+
+        if op == 0x27:
+            # find close
+            self.found = []
+            return([self._status(op, STATUS_OK)])
+
+        if op == 0x24:
+            # delete
+            name = _name(packet, 5)
+            status = STATUS_OK if self.files.pop(name, None) is not None \
+                    else STATUS_NOT_FOUND
+            self.result = self._status(0x05, status)
+            return([self._status(op, status)])
+
+        if op == 0x20:
+            # open, 0x01 = write (appending to existing) 0x02 = read
+            name = _name(packet, 15)
+            if packet[5] == 0x02 and name not in self.files:
+                self.handle = None
+                status = STATUS_NOT_FOUND
+            else:
+                self.handle = name
+                self.position = 0
+                if packet[5] == 0x01:
+                    self.files.setdefault(name, bytearray())
+                status = STATUS_OK
+            self.result = self._status(0x05, status)
+            return([self._status(op, status)])
+
+        if op == 0x22:
+            # read next block, fetched with 0x05
+            if self.handle is None:
+                self.result = self._status(0x05, STATUS_NOT_OPEN)
+                return([self._status(op, STATUS_NOT_OPEN)])
+            length = bytes(packet[10:15])
+            length = sum(length[x] << (7 * x) for x in range(5))
+            data = self.files[self.handle]
+            block = data[self.position:self.position + length]
+            self.position = self.position + len(block)
+            self.result = self._block(block)
+            return([self._status(op, STATUS_OK)])
+
+        if op == 0x23:
+            # write block
+            length = packet[11] * 128 + packet[10]
+            block = zoomcodec.unpack(packet[15:-5])[:length]
+            if self.handle is None:
+                status = STATUS_NOT_OPEN
+            elif zoomcodec.checksum_value(packet) != \
+                    binascii.crc32(block):
+                status = STATUS_CHECKSUM
+            elif self.used() + len(block) > self.capacity:
+                status = STATUS_FULL
+            else:
+                self.files[self.handle] += block
+                status = STATUS_OK
+            self.result = self._status(0x05, status)
+            return([self._status(op, status)])
+
+        if op == 0x21:
+            # close
+            self.handle = None
+            return([self._status(op, STATUS_OK)])
+
+        if op == 0x09:
+            # flush
+            return([self._status(op, STATUS_OK)])
+
+        if op == 0x29:
+            # disk usage
+            available = self.capacity - self.used()
+            return([self._sysex(b"\x60\x04\x29\x01\x00\x08\x00" + \
+                    _value7(self.capacity) + _value7(available) + \
+                    b"\x00" * 5)])
+
+        return([])
+
+    def _location(self, bank, loc):
+        location = bank * self.bsize + loc
+        if location < len(self.patches):
+            return(location)
+        return(None)
+
+    def _patch(self, packet):
+        op = packet[3]
+
+        if op == 0x44:
+            # patch count and sizes
+            count = len(self.patches)
+            return([self._sysex(b"\x43" + \
+                    bytes([count & 0x7f, count >> 7, \
+                    self.psize & 0x7f, self.psize >> 7, 0x00, 0x00, \
+                    self.bsize & 0x7f, self.bsize >> 7, 0x00, 0x00]))])
+
+        if op == 0x46:
+            # download patch
+            location = self._location(packet[6] + (packet[7] << 7), \
+                    packet[8] + (packet[9] << 7))
+            data = self.patches[location] if location != None else b""
+            length = len(data)
+            return([self._sysex(b"\x45" + bytes(packet[4:10]) + \
+                    bytes([length & 0x7f, length >> 7]) + \
+                    zoomcodec.pack(data) + zoomcodec.checksum(data))])
+
+        if op == 0x45:
+            # upload patch
+            location = self._location(packet[6] + (packet[7] << 7), \
+                    packet[8] + (packet[9] << 7))
+            length = packet[11] * 128 + packet[10]
+            data = bytes(zoomcodec.unpack(packet[12:-5])[:length])
+            if location != None and \
+                    zoomcodec.checksum_value(packet) == binascii.crc32(data):
+                self.patches[location] = data
+            return([self._ack()])
+
+        if op == 0x09:
+            # download patch, old method
+            location = self._location(packet[5], packet[6])
+            data = self.patches[location] if location != None else b""
+            length = len(data)
+            return([self._sysex(b"\x08" + bytes(packet[4:7]) + \
+                    bytes([length & 0x7f, length >> 7]) + \
+                    zoomcodec.pack(data) + zoomcodec.checksum(data))])
+
+        if op == 0x08:
+            # upload patch, old method
+            location = self._location(packet[5], packet[6])
+            length = packet[8] * 128 + packet[7]
+            data = bytes(zoomcodec.unpack(packet[9:-5])[:length])
+            if location != None and \
+                    zoomcodec.checksum_value(packet) == binascii.crc32(data):
+                self.patches[location] = data
+            return([self._ack()])
+
+        if op == 0x29:
+            # current patch, old method
+            return([self._sysex(b"\x28" + zoomcodec.pack(self.current))])
+
+        return([])
+
+    def _control(self, packet):
+        op = packet[3]
+
+        if op in (0x50, 0x51, 0x52, 0x53):
+            # editor/PC mode on/off
+            if op < 0x52:
+                self.editor = (op == 0x50)
+            else:
+                self.pcmode = (op == 0x52)
+            return([self._ack()])
+
+        if op == 0x64 and len(packet) > 4:
+            if packet[4] == 0x13:
+                # current patch
+                data = self.current
+                length = len(data)
+                return([self._sysex(b"\x64\x12\x01" + \
+                        bytes([length & 0x7f, length >> 7]) + \
+                        zoomcodec.pack(data) + zoomcodec.checksum(data))])
+            if packet[4] == 0x02 and len(packet) > 7:
+                # screen dump, records of screen/param/type/invert/value
+                records = bytearray()
+                for screen in range(packet[5], min(packet[6] + 1, len(self.screens))):
+                    for param, (name, value) in enumerate(self.screens[screen]):
+                        records += bytes([screen, param, 0x00, 0x00]) + \
+                                value.encode("ascii")[:10].ljust(10, b"\x00")
+                        if name and not packet[7]:
+                            records += bytes([screen, param, 0x01, 0x00]) + \
+                                    name.encode("ascii")[:10].ljust(10, b"\x00")
+                return([self._sysex(b"\x64\x01" + records)])
+            if packet[4] == 0x0b or packet[4] == 0x0c:
+                # tuner on/off, no reply
+                self.tuner = (packet[4] == 0x0b)
+            return([])
+
+        if op == 0x33:
+            # current bank/program, sent as CC/PC
+            return([b"\xb0\x00\x00", b"\xb0\x20\x00", b"\xc0\x00"])
+
+        return([])
+
+    def _corrupt(self, message):
+        # flip a bit in the middle of long messages, as if on the wire
+        if self.noise and len(message) > 64 and random.random() < self.noise:
+            middle = len(message) // 2
+            message = message[:middle] + bytes([message[middle] ^ 0x01]) + \
+                    message[middle + 1:]
+        return(message)
+
+    def process(self, message):
+        # handle one complete MIDI message, returning list of replies
+        message = bytes(message)
+        if message[:4] != b"\xf0" + self.header or message[-1:] != b"\xf7":
+            return([])
+        packet = message[1:-1]
+        if len(packet) < 4:
+            return([])
+
+        with self.lock:
+            if packet[3] == 0x60 and len(packet) > 4:
+                replies = self._file(packet)
+            elif packet[3] in (0x44, 0x45, 0x46, 0x08, 0x09, 0x29):
+                replies = self._patch(packet)
+            else:
+                replies = self._control(packet)
+        return([self._corrupt(reply) for reply in replies])
+
+    def tune(self, note, delta=0):
+        # send tuner information, as when in editor mode
+        if self.tuner:
+            for transport in self.transports:
+                transport.deliver(bytes([0xb0, 98, note]))
+                transport.deliver(bytes([0xb0, 99, delta + 8]))
+
+    #--------------------------------------------------
+    # connection to a 'zoomzt2' object
+
+    def transport(self):
+        transport = zoomtransport.LoopbackTransport(self.process, self.latency)
+        self.transports.append(transport)
+        return(transport)
+
+    def attach(self, pedal):
+        pedal.attach(self.transport())
+
+    def serve(self, name="ZOOM G Virtual Pedal"):
+        # answer on a mido virtual port, until interrupted
+        port = mido.open_ioport(name, virtual=True)
+        for msg in port:
+            if self.latency:
+                sleep(self.latency)
+            for reply in self.process(msg.bytes()):
+                port.send(mido.Message.from_bytes(reply))
+
+#--------------------------------------------------
+
+def benchmark(pedal, size, name="BENCH.ZD2", window=1):
+    # time a round trip of 'size' bytes through the file transfer methods
+    data = os.urandom(size)
+
+    start = monotonic()
+    pedal.file_check(name)
+    pedal.file_upload(name, data, window)
+    pedal.file_close()
+    upload = monotonic() - start
+
+    start = monotonic()
+    pedal.file_check(name)
+    received = pedal.file_download(name)
+    pedal.file_close()
+    download = monotonic() - start
+
+    if bytes(received) != data:
+        print("Data mismatch on download")
+
+    pedal.file_delete(name)
+    return(upload, download)
+
+def main():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(prog="zoomemu")
+
+    parser.add_argument("-d", "--dir", dest="dir",
+        help="load files for the virtual pedal from DIR")
+    parser.add_argument("-l", "--latency", type=float, default=0,
+        dest="latency", help="delay (in seconds) added to each reply")
+    parser.add_argument("-w", "--window", type=int, default=1,
+        dest="window", help="blocks in flight when uploading (use with --benchmark)")
+    parser.add_argument("--noise", type=float, default=0, dest="noise",
+        help="chance (0..1) of corrupting each data reply")
+    parser.add_argument("--patches", type=int, default=50, dest="patches",
+        help="number of patches held by the virtual pedal")
+
+    parser.add_argument("-n", "--name", dest="name",
+        default="ZOOM G Virtual Pedal",
+        help="name of the virtual port (use with --serve)")
+
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--serve",
+        help="answer requests on a MIDI virtual port",
+        action="store_true", dest="serve")
+    action.add_argument("-b", "--benchmark", type=int, dest="benchmark",
+        help="time upload/download of BENCHMARK bytes, in process")
+
+    options = parser.parse_args()
+
+    emu = VirtualPedal(patches=options.patches, latency=options.latency, \
+            noise=options.noise)
+    if options.dir:
+        emu.load(options.dir)
+
+    if options.benchmark:
+        import zoomzt2
+
+        pedal = zoomzt2.zoomzt2()
+        emu.attach(pedal)
+        pedal.pcmode_on()
+
+        upload, download = benchmark(pedal, options.benchmark, \
+                window=options.window)
+        if pedal.retry_count:
+            print("Retries: %d" % sum(pedal.retry_count.values()))
+        print("Upload:   %d bytes in %.3fs (%.1f KB/s)" % (options.benchmark, \
+                upload, options.benchmark / upload / 1024))
+        print("Download: %d bytes in %.3fs (%.1f KB/s)" % (options.benchmark, \
+                download, options.benchmark / download / 1024))
+
+        pedal.disconnect()
+        sys.exit()
+
+    if options.serve:
+        emu.serve(options.name)
+
+if __name__ == "__main__":
+    main()
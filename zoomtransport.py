@@ -0,0 +1,421 @@
+#!/usr/bin/python
+#
+# Transports carrying MIDI messages between 'zoomzt2' and a pedal
+#
+# Messages are complete, pre-encoded MIDI messages as bytes (SysEx
+# including the F0/F7 framing), so no per-message objects are built.
+#
+# Backends:
+#   MidoTransport     - mido (python-rtmidi) ports
+#   RawMidiTransport  - ALSA rawmidi device, ie. /dev/snd/midiC1D0
+#   LoopbackTransport - in memory, optionally answered by a handler
+#
+# A session can be captured with RecordingTransport (wrapping any of
+# the above) and played back later with ReplayTransport.
+#
+
+import os
+import re
+import glob
+import queue
+import struct
+import select
+import threading
+from time import sleep, monotonic
+
+
+class Transport(object):
+    def send(self, message):
+        raise NotImplementedError
+
+    def receive(self, timeout=None):
+        # next received message, or None if 'timeout' seconds pass
+        raise NotImplementedError
+
+    def request(self, message, timeout=None):
+        self.send(message)
+        return(self.receive(timeout))
+
+    def stream(self, timeout=0):
+        # yield received messages, until none arrive within 'timeout'
+        while True:
+            message = self.receive(timeout)
+            if message is None:
+                break
+            yield message
+
+    def set_receiver(self, receiver):
+        # pass received messages to 'receiver(message, delay)' as they
+        # arrive, instead of queuing them for receive(); 'delay' is the
+        # seconds before the message is due (simulated latency). This
+        # fallback pumps receive() from a thread, None stops it
+        self.receiver = receiver
+        if receiver != None:
+            thread = threading.Thread(target=self._pump)
+            thread.daemon = True
+            thread.start()
+
+    def _pump(self):
+        receiver = self.receiver
+        while self.receiver == receiver:
+            message = self.receive(0.5)
+            if message is not None and self.receiver == receiver:
+                receiver(message, 0)
+
+    def close(self):
+        pass
+
+
+class MidoTransport(Transport):
+    def __init__(self, inname, outname):
+        import mido
+
+        self.mido = mido
+        self.incoming = queue.Queue()
+        self.receiver = None
+        self.inport = mido.open_input(inname, callback=self._incoming)
+        self.outport = mido.open_output(outname)
+
+    def _incoming(self, msg):
+        if self.receiver != None:
+            self.receiver(bytes(msg.bytes()), 0)
+        else:
+            self.incoming.put(bytes(msg.bytes()))
+
+    def set_receiver(self, receiver):
+        # called directly from mido's input callback
+        self.receiver = receiver
+
+    def send(self, message):
+        self.outport.send(self.mido.Message.from_bytes(message))
+
+    def receive(self, timeout=None):
+        try:
+            return(self.incoming.get(True, timeout))
+        except queue.Empty:
+            return(None)
+
+    def close(self):
+        self.inport.close()
+        self.outport.close()
+
+
+class MidiParser(object):
+    # split a MIDI byte stream into complete messages
+    lengths = {0x80: 3, 0x90: 3, 0xa0: 3, 0xb0: 3, 0xc0: 2, 0xd0: 2, 0xe0: 3,
+            0xf1: 2, 0xf2: 3, 0xf3: 2, 0xf6: 1}
+
+    def __init__(self):
+        self.partial = None
+        self.running = None
+        self.expect = 0
+
+    def feed(self, data):
+        messages = []
+        for byte in data:
+            if byte >= 0xf8:
+                # real time, ignored
+                continue
+
+            if byte == 0xf0:
+                self.partial = bytearray(b"\xf0")
+                self.running = None
+                continue
+
+            if byte == 0xf7:
+                if self.partial and self.partial[0] == 0xf0:
+                    self.partial.append(byte)
+                    messages.append(bytes(self.partial))
+                self.partial = None
+                continue
+
+            if byte & 0x80:
+                self.expect = self.lengths.get(byte & 0xf0 if byte < 0xf0 \
+                        else byte, 1)
+                self.running = byte if byte < 0xf0 else None
+                self.partial = bytearray([byte])
+            elif self.partial is None:
+                if self.running is None:
+                    continue
+                self.partial = bytearray([self.running, byte])
+            else:
+                self.partial.append(byte)
+
+            if self.partial[0] != 0xf0 and len(self.partial) == self.expect:
+                messages.append(bytes(self.partial))
+                self.partial = None
+        return(messages)
+
+
+class RawMidiTransport(Transport):
+    def __init__(self, device):
+        self.fd = os.open(device, os.O_RDWR)
+        self.parser = MidiParser()
+        self.incoming = []
+
+    def send(self, message):
+        view = memoryview(message)
+        while len(view):
+            view = view[os.write(self.fd, view):]
+
+    def receive(self, timeout=None):
+        if timeout is not None:
+            deadline = monotonic() + timeout
+
+        while not self.incoming:
+            if timeout is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return(None)
+                ready, _, _ = select.select([self.fd], [], [], remaining)
+                if not ready:
+                    return(None)
+            self.incoming.extend(self.parser.feed(os.read(self.fd, 4096)))
+        return(self.incoming.pop(0))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LoopbackTransport(Transport):
+    def __init__(self, handler=None, latency=0):
+        # 'handler' returns list of replies for each message sent,
+        # without one every message is echoed back
+        self.handler = handler
+        self.latency = latency
+        self.incoming = queue.Queue()
+        self.held = None        # (due, message) not yet due at a timeout
+        self.receiver = None
+
+    def deliver(self, message, delay=0):
+        if self.receiver != None:
+            self.receiver(bytes(message), delay)
+        else:
+            self.incoming.put((monotonic() + delay, bytes(message)))
+
+    def set_receiver(self, receiver):
+        self.receiver = receiver
+
+    def send(self, message):
+        if self.handler:
+            replies = self.handler(message)
+        else:
+            replies = [message]
+        for reply in replies:
+            self.deliver(reply, self.latency)
+
+    def receive(self, timeout=None):
+        # a message which is not due before 'timeout' runs out is held
+        # back for the next call, as a late reply would be
+        if timeout is not None:
+            deadline = monotonic() + timeout
+        if self.held is None:
+            try:
+                self.held = self.incoming.get(True, timeout)
+            except queue.Empty:
+                return(None)
+
+        due, message = self.held
+        if timeout is not None and due > deadline:
+            wait = deadline - monotonic()
+            if wait > 0:
+                sleep(wait)
+            return(None)
+        wait = due - monotonic()
+        if wait > 0:
+            sleep(wait)
+        self.held = None
+        return(message)
+
+
+# Capture file: magic, then a record per message of direction (0 sent,
+# 1 received), microseconds since the previous record and length
+CAPTURE_MAGIC = b"ZZT2CAP1"
+CAPTURE_RECORD = struct.Struct("<BII")
+SENT = 0
+RECEIVED = 1
+
+class RecordingTransport(Transport):
+    def __init__(self, transport, filename):
+        self.transport = transport
+        self.capture = open(filename, "wb")
+        self.capture.write(CAPTURE_MAGIC)
+        self.last = monotonic()
+        self.lock = threading.Lock()
+        self.receiver = None
+
+    def record(self, direction, message):
+        with self.lock:
+            now = monotonic()
+            delta = min(int((now - self.last) * 1000000), 0xFFFFFFFF)
+            self.last = now
+            self.capture.write(CAPTURE_RECORD.pack(direction, delta, len(message)))
+            self.capture.write(message)
+            self.capture.flush()
+
+    def send(self, message):
+        self.record(SENT, message)
+        self.transport.send(message)
+
+    def receive(self, timeout=None):
+        message = self.transport.receive(timeout)
+        if message is not None:
+            self.record(RECEIVED, message)
+        return(message)
+
+    def _received(self, message, delay):
+        self.record(RECEIVED, message)
+        self.receiver(message, delay)
+
+    def set_receiver(self, receiver):
+        self.receiver = receiver
+        if receiver != None:
+            self.transport.set_receiver(self._received)
+        else:
+            self.transport.set_receiver(None)
+
+    def close(self):
+        self.transport.close()
+        self.capture.close()
+
+
+def read_capture(filename):
+    # list of (direction, seconds since start, message)
+    infile = open(filename, "rb")
+    data = infile.read()
+    infile.close()
+
+    if data[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+        raise ValueError("'%s' is not a capture file" % filename)
+
+    records = []
+    when = 0.0
+    offset = len(CAPTURE_MAGIC)
+    while offset + CAPTURE_RECORD.size <= len(data):
+        direction, delta, length = CAPTURE_RECORD.unpack_from(data, offset)
+        offset = offset + CAPTURE_RECORD.size
+        when = when + delta / 1000000.0
+        records.append((direction, when, data[offset:offset + length]))
+        offset = offset + length
+    return(records)
+
+
+class ReplayTransport(LoopbackTransport):
+    def __init__(self, filename, speed=0):
+        # each message sent is answered by the messages received after
+        # it in the capture, delayed as recorded divided by 'speed'
+        # (0 for no delay). Messages differing from the capture are
+        # counted in 'mismatches'
+        LoopbackTransport.__init__(self)
+        self.records = read_capture(filename)
+        self.speed = speed
+        self.position = 0
+        self.mismatches = 0
+        self._replay(0)
+
+    def _replay(self, sent):
+        # queue received messages up to the next one sent
+        while self.position < len(self.records):
+            direction, when, message = self.records[self.position]
+            if direction == SENT:
+                break
+            delay = 0
+            if self.speed:
+                delay = (when - sent) / self.speed
+            self.deliver(message, delay)
+            self.position = self.position + 1
+
+    def send(self, message):
+        if self.position >= len(self.records):
+            self.mismatches = self.mismatches + 1
+            return
+        direction, when, recorded = self.records[self.position]
+        if bytes(message) != recorded:
+            self.mismatches = self.mismatches + 1
+        self.position = self.position + 1
+        self._replay(when)
+
+    def receive(self, timeout=None):
+        # nothing more can arrive once the queue is empty
+        if self.held is None and self.incoming.empty():
+            return(None)
+        return(LoopbackTransport.receive(self, timeout))
+
+#--------------------------------------------------
+
+def _mido_ports(names, midiskip):
+    import mido
+
+    ports = []
+    for getnames in (mido.get_input_names, mido.get_output_names):
+        found = None
+        skip = midiskip
+        for port in getnames():
+            for midiname in names:
+                if port[:len(midiname)] == midiname:
+                    if not skip:
+                        found = port
+                        break
+                    else:
+                        skip = skip - 1
+            if found != None:
+                break
+        ports.append(found)
+    return(ports)
+
+def _rawmidi_devices(names):
+    # match card names listed by ALSA, ie.
+    #  1 [Series         ]: USB-Audio - ZOOM G Series
+    devices = []
+    try:
+        cards = open("/proc/asound/cards", "r")
+    except IOError:
+        return(devices)
+
+    for line in cards:
+        match = re.match(r"^\s*(\d+)\s+\[.*\]:\s*\S+\s+-\s+(.*)$", line)
+        if match:
+            for midiname in names:
+                if match.group(2)[:len(midiname)] == midiname:
+                    devices.extend(sorted(glob.glob("/dev/snd/midiC%sD*" \
+                            % match.group(1))))
+                    break
+    cards.close()
+    return(devices)
+
+def count_devices(names, backend="mido"):
+    # number of pedals matching 'names', each opened with its index as
+    # 'midiskip'
+    if backend == "mido":
+        import mido
+
+        inputs = [port for port in mido.get_input_names() \
+                if [name for name in names if port[:len(name)] == name]]
+        outputs = [port for port in mido.get_output_names() \
+                if [name for name in names if port[:len(name)] == name]]
+        return(min(len(inputs), len(outputs)))
+    elif backend == "rawmidi":
+        return(len(_rawmidi_devices(names)))
+    raise ValueError("Cannot count devices for transport '%s'" % backend)
+
+def open_transport(names, midiskip=0, backend="mido", capture=None, speed=0):
+    # open the pedal matching 'names', or None if not found. With
+    # 'capture' the session is recorded to that file, or for the
+    # "replay" backend played back from it
+    transport = None
+    if backend == "mido":
+        inname, outname = _mido_ports(names, midiskip)
+        if inname != None and outname != None:
+            transport = MidoTransport(inname, outname)
+    elif backend == "rawmidi":
+        devices = _rawmidi_devices(names)
+        if midiskip < len(devices):
+            transport = RawMidiTransport(devices[midiskip])
+    elif backend == "replay":
+        return(ReplayTransport(capture, speed))
+    else:
+        raise ValueError("Unknown transport '%s'" % backend)
+
+    if transport != None and capture:
+        transport = RecordingTransport(transport, capture)
+    return(transport)
@@ -24,6 +24,7 @@ class _479389042__675845753_MyFrame(wx.Frame):
     effects = []
     files = []
     pedal = None
+    session = None
 
     def __init__(self, *args, **kwds):
         # begin wxGlade: _479389042__675845753_MyFrame.__init__
@@ -159,22 +160,19 @@ class _479389042__675845753_MyFrame(wx.Frame):
         self.effect = dlg.GetPath()
         dlg.Destroy()
 
-        binfile = open(self.effect, "rb")
-        if binfile:
-            bindata = binfile.read()
-            binfile.close()
+        # only the header and description are needed, not a full parse
+        effect = zoomzt2.ZD2Reader(self.effect)
+        head, tail = os.path.split(self.effect)
+        self.text_ctrl_1.SetValue(tail + " = " + effect.name)
+        self.text_ctrl_1.AppendText("\nVer  : " + effect.version)
+        self.text_ctrl_1.AppendText("\nGroup: " + str(effect.group) + " (" \
+                + effect.groupname + ")")
+        self.text_ctrl_1.AppendText("\nID   : " + hex(effect.id))
+        self.text_ctrl_1.AppendText("\n\n" + effect.description())
+        effect.close()
 
-            config = zoomzt2.ZD2.parse(bindata)
-            head, tail = os.path.split(self.effect)
-            self.text_ctrl_1.SetValue(tail + " = " + config['name'])
-            self.text_ctrl_1.AppendText("\nVer  : " + config['version'])
-            self.text_ctrl_1.AppendText("\nGroup: " + str(config['group']) + " (" \
-                    + config['groupname'] + ")")
-            self.text_ctrl_1.AppendText("\nID   : " + hex(config['id']))
-            self.text_ctrl_1.AppendText("\n\n" + config['TXE1']['description'])
-
-            self.button_6.SetLabel(tail)
-            self.button_3.Enable()
+        self.button_6.SetLabel(tail)
+        self.button_3.Enable()
 
         filename, extension = os.path.splitext(self.effect)
         zicfilename = filename + ".ZIC"
@@ -202,25 +200,20 @@ class _479389042__675845753_MyFrame(wx.Frame):
             event.Skip()
             return
 
-        self.pedal.file_check("FLST_SEQ.ZT2")
-        data = self.pedal.file_download("FLST_SEQ.ZT2")
-
         binfile = open(self.effect, "rb")
         if binfile:
             bindata = binfile.read()
             binfile.close()
 
-            binconfig = zoomzt2.ZD2.parse(bindata)
+            # refuse anything which is not an effect before uploading
+            zoomzt2.zd2_header(bindata)
 
             if not self.pedal.file_check(self.effect):
                 self.pedal.file_upload(self.effect, bindata)
             self.pedal.file_close()
 
-            data = self.pedal.add_effect_from_filename(data, self.effect)
-
-            self.pedal.file_check("FLST_SEQ.ZT2")
-            self.pedal.file_upload("FLST_SEQ.ZT2", data)
-            self.pedal.file_close()
+            self.session.add_from_filename(self.effect)
+            self.session.commit()
 
             self.text_ctrl_1.AppendText("\n\nEffect installed!")
             self.button_3.Disable()
@@ -279,14 +272,8 @@ class _479389042__675845753_MyFrame(wx.Frame):
             if self.pedal.file_check(name):
                 self.pedal.file_delete(name)
 
-            self.pedal.file_check("FLST_SEQ.ZT2")
-            data = self.pedal.file_download("FLST_SEQ.ZT2")
-
-            data = self.pedal.remove_effect(data, name)
-
-            self.pedal.file_check("FLST_SEQ.ZT2")
-            self.pedal.file_upload("FLST_SEQ.ZT2", data)
-            self.pedal.file_close()
+            self.session.remove(name)
+            self.session.commit()
 
             # Remove .zic-file if it exists and if option is enabled
             if self.checkbox_include_zic.IsChecked:
@@ -391,6 +378,8 @@ class _479389042__675845753_MyFrame(wx.Frame):
     def ConnectPedal(self):
         if self.pedal.connect(options.midiskip):
             self.pedal.pcmode_on()
+            # FLST_SEQ is read once per connection, then kept in step
+            self.session = zoomzt2.FlstSession(self.pedal)
             self.ReadEffects()
             self.ReadFiles()
             self.UpdateButtons()
@@ -402,29 +391,20 @@ class _479389042__675845753_MyFrame(wx.Frame):
         self.UpdateButtons()
 
     def ReadEffects(self):
-        self.pedal.file_check("FLST_SEQ.ZT2")
-        data = self.pedal.file_download("FLST_SEQ.ZT2")
-        self.pedal.file_close()
-
-        if not data:
+        model = self.session.model
+        if not model:
             return False
 
-        config = zoomzt2.ZT2.parse(data)
         self.effects.clear()
-        for group in config[1]:
-            for effect in dict(group)["effects"]:
-                if effect['installed']:
-                    self.effects.append(dict(effect)["effect"])
+        for effect in model.effects():
+            if effect['installed']:
+                self.effects.append(effect["effect"])
 
         self.list_box_1.Set(self.effects)
 
     def ReadFiles(self):
-        name = self.pedal.file_wild(True)
-        if name:
-            self.files.clear()
-        while name:
-            self.files.append(name)
-            name = self.pedal.file_wild(False)
+        # listing is cached, and kept in step with install/remove/delete
+        self.files = self.pedal.file_list()
         self.pedal.file_close()
 
         self.list_box_2.Set(self.files)
@@ -205,156 +205,957 @@ ZD2 = Struct(
 #--------------------------------------------------
 import os
 import sys
-import mido
+import json
+import mmap
+import atexit
+import bisect
+import collections
+import zipfile
 import binascii
-from time import sleep
+import queue
+import shlex
+import struct
+import threading
+import contextlib
+from time import sleep, monotonic
+
+import zoomcodec
+import zoomtransport
 
 
 midinames = ["ZOOM G", "ZOOM MS Plus Series"]
 
+# Pre-encoded requests, complete with SysEx framing
+EDITOR_ON = b"\xf0\x52\x00\x6e\x50\xf7"
+EDITOR_OFF = b"\xf0\x52\x00\x6e\x51\xf7"
+PCMODE_ON = b"\xf0\x52\x00\x6e\x52\xf7"
+PCMODE_OFF = b"\xf0\x52\x00\x6e\x53\xf7"
+
+FILE_STATUS = b"\xf0\x52\x00\x6e\x60\x05\x00\xf7"
+FILE_READ = b"\xf0\x52\x00\x6e\x60\x22\x14\x2f\x60\x00\x0c\x00\x04\x00\x00\x00\xf7"
+FILE_FIND_CLOSE = b"\xf0\x52\x00\x6e\x60\x27\xf7"
+FILE_CLOSE = b"\xf0\x52\x00\x6e\x60\x21\x40\x00\x00\x00\x00\xf7"
+FILE_FLUSH = b"\xf0\x52\x00\x6e\x60\x09\xf7"
+DISK_USAGE = b"\xf0\x52\x00\x6e\x60\x29\x00\x00\x00\x00\x00\xf7"
+
+PATCH_CHECK = b"\xf0\x52\x00\x6e\x44\xf7"
+PATCH_CURRENT = b"\xf0\x52\x00\x6e\x64\x13\xf7"
+PATCH_CURRENT_OLD = b"\xf0\x52\x00\x6e\x29\xf7"
+
+TUNER_ON = b"\xf0\x52\x00\x6e\x64\x0b\xf7"
+TUNER_OFF = b"\xf0\x52\x00\x6e\x64\x0c\xf7"
+TUNER_NOTES = ["A", "A#", "B", "C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "-"]
+
+#--------------------------------------------------
+# Fast FLST_SEQ (ZT2) codec
+#
+# Parses/builds the fixed 8502 byte layout directly with 'struct', giving
+# the same containers as the 'ZT2' construct definition (which is used
+# instead for anything this does not recognise, so errors are the same).
+# Checked against construct by 'tests/test_zt2_codec.py'.
+
+ZT2_SIZE = 8502
+ZT2_HEADER = struct.Struct("<4s22x12s6xB7x4s22x")
+ZT2_GROUP = struct.Struct("<4sB21x")         # start and end of group
+ZT2_EFFECT = struct.Struct("<12sB4sBBI3s")
+
+_GROUPNAME = [subcon for subcon in Group.subcons if subcon.name == "groupname"][0].subcon
+
+def group_name(number):
+    # name of group 'number' as parsing gives it, or the number if unknown
+    return(_GROUPNAME.decmapping.get(number, number))
+
+def _zt2_parse(data):
+    # Container as ZT2.parse(), or None where construct is needed
+    if len(data) < ZT2_SIZE:
+        return(None)
+    view = memoryview(data)
+    magic, name, one, end = ZT2_HEADER.unpack_from(view, 0)
+    if magic != b"\x3e\x3e\x3e\x00" or one != 1 or end != b"\x3c\x3c\x3c\x00":
+        return(None)
+    offset = ZT2_HEADER.size
+    limit = len(view) - ZT2_GROUP.size
+
+    try:
+        header = Container(name=name.rstrip(b"\x00").decode("ascii"))
+        groups = ListContainer()
+        while offset <= limit:
+            magic, group = ZT2_GROUP.unpack_from(view, offset)
+            if magic != b"\x3e\x3e\x3e\x00":
+                break
+            position = offset + ZT2_GROUP.size
+
+            # effects continue while they parse and belong to the group
+            effects = ListContainer()
+            while position <= limit - ZT2_EFFECT.size:
+                (effect, zero1, version, zero2, installed, id, zeros) = \
+                        ZT2_EFFECT.unpack_from(view, position)
+                if zero1 or zero2 or zeros != b"\x00\x00\x00" or id >> 24 != group:
+                    break
+                effects.append(Container(effect=effect.rstrip(b"\x00").decode("ascii"),
+                        version=version.rstrip(b"\x00").decode("ascii"),
+                        installed=installed, id=id, group=group))
+                position = position + ZT2_EFFECT.size
+
+            if position > limit:
+                break
+            magic, group_end = ZT2_GROUP.unpack_from(view, position)
+            if magic != b"\x3c\x3c\x3c\x00" or group_end != group:
+                break
+            groups.append(Container(group=group,
+                    groupname=group_name(group),
+                    effects=effects, group_end=group_end))
+            offset = position + ZT2_GROUP.size
+    except UnicodeDecodeError:
+        return(None)
+
+    if offset > ZT2_SIZE:
+        return(None)
+    return(ListContainer([header, groups]))
+
+def _zt2_build(config):
+    # bytes as ZT2.build(), or None where construct is needed
+    data = bytearray(ZT2_SIZE)
+    try:
+        name = config[0]['name'].encode("ascii")
+        if len(name) > 12:
+            return(None)
+        ZT2_HEADER.pack_into(data, 0, b"\x3e\x3e\x3e\x00", name, 1,
+                b"\x3c\x3c\x3c\x00")
+        offset = ZT2_HEADER.size
+
+        for group in config[1]:
+            number = group['group']
+            name = group['groupname']
+            if not isinstance(name, int) and name not in _GROUPNAME.encmapping:
+                return(None)
+            effects = group['effects']
+            if offset + ZT2_GROUP.size * 2 + ZT2_EFFECT.size * len(effects) > ZT2_SIZE:
+                return(None)
+
+            ZT2_GROUP.pack_into(data, offset, b"\x3e\x3e\x3e\x00", number)
+            offset = offset + ZT2_GROUP.size
+            for effect in effects:
+                id = effect['id']
+                name = effect['effect'].encode("ascii")
+                version = effect['version'].encode("ascii")
+                if id >> 24 != number or len(name) > 12 or len(version) > 4:
+                    return(None)
+                installed = effect.get('installed')
+                if installed == None:
+                    installed = 1
+                ZT2_EFFECT.pack_into(data, offset, name, 0, version, 0,
+                        installed, id, b"\x00\x00\x00")
+                offset = offset + ZT2_EFFECT.size
+            ZT2_GROUP.pack_into(data, offset, b"\x3c\x3c\x3c\x00", number)
+            offset = offset + ZT2_GROUP.size
+    except (KeyError, TypeError, ValueError, AttributeError, struct.error):
+        return(None)
+    return(bytes(data))
+
+def zt2_parse(data):
+    # parse FLST_SEQ, as ZT2.parse()
+    config = _zt2_parse(data)
+    if config == None:
+        config = ZT2.parse(data)
+    return(config)
+
+def zt2_build(config):
+    # build FLST_SEQ, as ZT2.build()
+    data = _zt2_build(config)
+    if data == None:
+        data = ZT2.build(config)
+    return(data)
+
+# groups listed in an empty FLST_SEQ (as 'EMPTY.ZT2')
+EMPTY_GROUPS = (1, 2, 3, 4, 5, 6, 7, 8, 9, 11)
+
+def zt2_empty():
+    # config of FLST_SEQ listing no effects, as zt2_parse() of 'EMPTY.ZT2'
+    groups = ListContainer()
+    for number in EMPTY_GROUPS:
+        groups.append(Container(group=number, groupname=group_name(number),
+                effects=ListContainer(), group_end=number))
+    return(ListContainer([Container(name="BYPASS.ZD2"), groups]))
+
+# Fields needed to list an effect, from the start of a ZD2: magic,
+# version, padding, group and id (see 'ZD2')
+ZD2_HEADER = struct.Struct("<4s85x4s2sBI")
+
+def zd2_header(data):
+    # (version, id) of ZD2 effect, as ZD2.parse() gives them but only
+    # looking at the first ZD2_HEADER.size bytes of 'data'
+    if len(data) < ZD2_HEADER.size:
+        raise ValueError("too short for a ZD2 effect")
+    magic, version, zeros, group, id = ZD2_HEADER.unpack_from(data, 0)
+    if magic != b"ZDLF" or zeros != b"\x00\x00":
+        raise ValueError("not a ZD2 effect")
+    return(version.rstrip(b"\x00").decode("ascii"), id)
+
+def zd2_read_header(filename):
+    # zd2_header() of file, reading no more of it than needed
+    infile = open(filename, "rb")
+    data = infile.read(ZD2_HEADER.size)
+    infile.close()
+    return(zd2_header(data))
+
+# Chunks follow the fixed header (and the 11 byte name and groupname
+# fields), the last 16 bytes of the file are not a chunk
+ZD2_CHUNKS = 128
+ZD2_CHUNK = struct.Struct("<4sI")
+ZD2_TRAILER = 16
+
+class ZD2Reader(object):
+    # Lazy view of a ZD2 effect over an mmap of the file. The fixed
+    # header is decoded on open, chunk offsets are only found when a
+    # chunk is first asked for, and chunk() returns memoryviews of the
+    # mapping, so listing effects touches a few hundred bytes of each.
+    # close() once done, after releasing any views taken
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        self.map = None
+        self.chunks = None
+        try:
+            size = os.fstat(self.file.fileno()).st_size
+            if size < ZD2_CHUNKS:
+                raise ValueError("too short for a ZD2 effect")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+            self.version, self.id = zd2_header(self.view)
+        except:
+            self.close()
+            raise
+
+        self.length, self.checksum, self.target = \
+                struct.unpack_from("<III", self.view, 4)
+        self.group = self.view[95]
+        self.name = self._string(100)
+        self.groupname = self._string(111)
+
+    def _string(self, offset):
+        # name fields are 11 bytes, null terminated unless full
+        return(self.view[offset:offset + 11].tobytes().split(b"\x00")[0].decode("ascii"))
+
+    def index(self):
+        # {tag: (offset, length)} of chunk payloads
+        if self.chunks == None:
+            self.chunks = collections.OrderedDict()
+            offset = ZD2_CHUNKS
+            end = len(self.view) - ZD2_TRAILER
+            while offset + ZD2_CHUNK.size <= end:
+                tag, length = ZD2_CHUNK.unpack_from(self.view, offset)
+                offset = offset + ZD2_CHUNK.size
+                if not tag.isalnum() or offset + length > end:
+                    break
+                self.chunks[tag.decode("ascii")] = (offset, length)
+                offset = offset + length
+        return(self.chunks)
+
+    def chunk(self, tag):
+        # payload of chunk (ie. "ICON"), or None if not present
+        found = self.index().get(tag)
+        if found == None:
+            return(None)
+        offset, length = found
+        return(self.view[offset:offset + length])
+
+    def dspload(self):
+        # as ZD2's INFO.dspload, the float ending the INFO chunk
+        info = self.chunk("INFO")
+        if info == None or len(info) < 4:
+            return(None)
+        return(struct.unpack_from("<f", info, len(info) - 4)[0])
+
+    def description(self):
+        # as ZD2's TXE1.description, text unless it does not decode
+        text = self.chunk("TXE1")
+        if text == None:
+            return(None)
+        try:
+            return(text.tobytes().decode("ascii").rstrip("\x00"))
+        except UnicodeDecodeError:
+            return(text.tobytes())
+
+    def close(self):
+        if self.map != None:
+            self.view.release()
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+class ReplyTimeout(IOError):
+    # no reply to a request, after all attempts
+    def __init__(self, message, timeout, attempts = 1):
+        IOError.__init__(self, "No reply to request %s within %ss, after %d attempt(s)" \
+                % (message_opcode(message), timeout, attempts))
+        self.message = bytes(message)
+        self.timeout = timeout
+        self.attempts = attempts
+
+class ChecksumError(IOError):
+    pass
+
+class Journal(object):
+    # on-disk record of the blocks committed by a transfer, kept next
+    # to the local file as 'FILE.journal'
+    def __init__(self, filename, name, direction, size = 0):
+        self.path = filename + ".journal"
+        self.name = os.path.basename(name)
+        self.direction = direction
+        self.size = size
+        self.journal = None
+
+    def load(self):
+        # return (offset, crc) committed by an earlier matching transfer
+        try:
+            infile = open(self.path, "r")
+            record = json.load(infile)
+            infile.close()
+        except (IOError, ValueError):
+            return(0, 0)
+
+        if record.get("name") != self.name or \
+                record.get("direction") != self.direction or \
+                record.get("size") != self.size:
+            return(0, 0)
+        return(record.get("offset", 0), record.get("crc", 0))
+
+    def commit(self, offset, crc):
+        if self.journal == None:
+            self.journal = open(self.path, "w")
+        self.journal.seek(0)
+        json.dump(dict(name=self.name, direction=self.direction,
+                size=self.size, offset=offset, crc=crc), self.journal)
+        self.journal.truncate()
+        self.journal.flush()
+
+    def remove(self):
+        if self.journal != None:
+            self.journal.close()
+            self.journal = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class Manifest(object):
+    # size and CRC32 of files on a pedal, as we last downloaded or
+    # uploaded them; kept locally as JSON (one file per pedal)
+    def __init__(self, filename):
+        self.path = filename
+        self.files = {}
+
+    def load(self):
+        try:
+            infile = open(self.path, "r")
+            self.files = json.load(infile)
+            infile.close()
+        except (IOError, ValueError):
+            self.files = {}
+
+    def save(self):
+        outfile = open(self.path, "w")
+        json.dump(self.files, outfile, indent=1, sort_keys=True)
+        outfile.close()
+
+    def record(self, name, data):
+        self.files[os.path.basename(name)] = dict(size=len(data),
+                crc=binascii.crc32(data))
+
+    def forget(self, name):
+        self.files.pop(os.path.basename(name), None)
+
+    def matches(self, name, data):
+        entry = self.files.get(os.path.basename(name))
+        if entry == None or entry["size"] != len(data):
+            return(False)
+        return(entry["crc"] == binascii.crc32(data))
+
+class PatchArchive(object):
+    # patches kept as 'PATCHnnn.ZPTC', either in a zip file (when the
+    # name ends '.zip') or a directory, indexed by 'index.json'
+    def __init__(self, path, mode = "r"):
+        self.path = path
+        self.mode = mode
+        self.zip = None
+        self.index = {}
+
+        if path.lower().endswith(".zip"):
+            self.zip = zipfile.ZipFile(path, mode, zipfile.ZIP_DEFLATED)
+        elif mode == "w" and not os.path.exists(path):
+            os.makedirs(path)
+
+        if mode == "r":
+            index = json.loads(self.read_file("index.json").decode("utf-8"))
+            for location in index:
+                self.index[int(location)] = index[location]
+
+    def filename(self, location):
+        return("PATCH%03d.ZPTC" % location)
+
+    def read_file(self, name):
+        if self.zip:
+            return(self.zip.read(name))
+        infile = open(os.path.join(self.path, name), "rb")
+        data = infile.read()
+        infile.close()
+        return(data)
+
+    def write_file(self, name, data):
+        if self.zip:
+            self.zip.writestr(name, bytes(data))
+        else:
+            outfile = open(os.path.join(self.path, name), "wb")
+            outfile.write(data)
+            outfile.close()
+
+    def locations(self):
+        return(sorted(self.index))
+
+    def read(self, location):
+        return(self.read_file(self.index[location]["name"]))
+
+    def write(self, location, data):
+        name = self.filename(location)
+        self.write_file(name, data)
+        self.index[location] = dict(name=name, size=len(data),
+                crc=binascii.crc32(data))
+
+    def close(self):
+        if self.mode == "w":
+            index = dict((str(location), self.index[location]) \
+                    for location in sorted(self.index))
+            self.write_file("index.json", json.dumps(index, indent=1).encode("utf-8"))
+        if self.zip:
+            self.zip.close()
+            self.zip = None
+
+class Stats(object):
+    # counters for the request/response path, enabled by setting the
+    # pedal's 'stats' to an instance. Traffic is keyed by opcode (with
+    # the sub-command for 0x60/0x64), replies that are not part of a
+    # round trip by their own opcode. Round trip latencies are
+    # histogrammed by upper bound in seconds
+    buckets = [0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02,
+            0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0]
+
+    def __init__(self):
+        self.started = monotonic()
+        self.opcodes = {}
+        self.timers = {}
+
+    def entry(self, message):
+        opcode = message_opcode(message)
+        if opcode not in self.opcodes:
+            self.opcodes[opcode] = dict(sent=0, sent_bytes=0, received=0,
+                    received_bytes=0, round_trips=0, latency=0.0,
+                    histogram=[0] * (len(self.buckets) + 1))
+        return(self.opcodes[opcode])
+
+    def send(self, message):
+        entry = self.entry(message)
+        entry["sent"] += 1
+        entry["sent_bytes"] += len(message)
+
+    def receive(self, message):
+        if message != None:
+            entry = self.entry(message)
+            entry["received"] += 1
+            entry["received_bytes"] += len(message)
+
+    def request(self, message, reply, elapsed):
+        # reply is counted against the request's opcode
+        entry = self.entry(message)
+        entry["sent"] += 1
+        entry["sent_bytes"] += len(message)
+        if reply != None:
+            entry["received"] += 1
+            entry["received_bytes"] += len(reply)
+        entry["round_trips"] += 1
+        entry["latency"] += elapsed
+        entry["histogram"][bisect.bisect_left(self.buckets, elapsed)] += 1
+
+    def timer(self, name, elapsed, length):
+        if name not in self.timers:
+            self.timers[name] = dict(calls=0, bytes=0, seconds=0.0)
+        self.timers[name]["calls"] += 1
+        self.timers[name]["bytes"] += length
+        self.timers[name]["seconds"] += elapsed
+
+    def report(self):
+        return(dict(elapsed=monotonic() - self.started, buckets=self.buckets,
+                opcodes=self.opcodes, timers=self.timers))
+
+    def dump(self, filename):
+        # write report as JSON, "-" for stdout
+        if filename == "-":
+            json.dump(self.report(), sys.stdout, indent=1, sort_keys=True)
+            print()
+        else:
+            outfile = open(filename, "w")
+            json.dump(self.report(), outfile, indent=1, sort_keys=True)
+            outfile.close()
+
+def message_opcode(message):
+    # opcode as text, with the sub-command for 0x60/0x64
+    if message[:4] == b"\xf0\x52\x00\x6e" and len(message) > 5:
+        if message[4] in (0x60, 0x64) and len(message) > 6:
+            return("%2.2x %2.2x" % (message[4], message[5]))
+        return("%2.2x" % message[4])
+    return("%2.2x" % (message[0] & 0xF0))
+
+# opcodes of the replies to each request opcode, any other message
+# received while waiting is unsolicited (ie. tuner CCs)
+REPLY_OPCODES = {
+    0x08: [0x00], 0x09: [0x08], 0x29: [0x28],
+    0x44: [0x43], 0x45: [0x00], 0x46: [0x45],
+    0x50: [0x00], 0x51: [0x00], 0x52: [0x00], 0x53: [0x00],
+    0x60: [0x60], 0x64: [0x64],
+}
+
+def is_reply(message, reply):
+    # whether 'reply' answers request 'message' (both with F0/F7)
+    if reply[:4] != b"\xf0\x52\x00\x6e" or len(reply) < 6:
+        return(False)
+    if message[4] == 0x64 and len(message) > 6:
+        # sub-command answered by the one below it, ie. 0x13 with 0x12
+        return(reply[4] == 0x64 and reply[5] == message[5] - 1)
+    if message[4] == 0x60 and len(message) > 6 and message[5] != 0x05:
+        # file replies echo the sub-command, ie. '60 04 29' for usage;
+        # the status (0x05) reports on whichever operation came before
+        return(reply[4] == 0x60 and len(reply) > 7 and reply[6] == message[5])
+    return(reply[4] in REPLY_OPCODES.get(message[4], [reply[4]]))
+
+def from_pedal(message):
+    # SysEx from the pedal's address, which any reply would be
+    return(message[:4] == b"\xf0\x52\x00\x6e")
+
+def log_unmatched(message, reply, taken = False):
+    # REPLY_OPCODES and is_reply() are partly inferred, so report
+    # messages from the pedal which did not fit the request waiting
+    if taken:
+        sys.stderr.write("No reply matched request %s, taking %s instead\n" \
+                % (message_opcode(message), message_opcode(reply)))
+    else:
+        sys.stderr.write("Ignored %s while waiting for a reply to %s\n" \
+                % (message_opcode(reply), message_opcode(message)))
+
+# requests changing state on the pedal each time they are made (file
+# open/read/write move the position, find next the listing), which are
+# never sent again after a timeout
+NO_RETRY = ["60 20", "60 22", "60 23", "60 26"]
+
+# requests which can take the pedal a while (flush after writing a large
+# file, deleting one), given 'slow' times the timeout
+SLOW = ["60 09", "60 24"]
+
+class RetryPolicy(object):
+    # Seconds to wait for each reply ('timeout', None for ever) and how
+    # many times to send a request again when none arrives, sleeping
+    # 'backoff' seconds before the first retry and 'factor' times longer
+    # before each one after
+    def __init__(self, timeout = 5.0, retries = 2, backoff = 0.1, factor = 2.0,
+            slow = 10.0):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.factor = factor
+        self.slow = slow
+
+    def copy(self, **settings):
+        policy = RetryPolicy(self.timeout, self.retries, self.backoff, self.factor,
+                self.slow)
+        for key in settings:
+            if not hasattr(policy, key):
+                raise TypeError("Unknown retry setting '%s'" % key)
+            setattr(policy, key, settings[key])
+        return(policy)
+
+    def attempts(self, message):
+        if message_opcode(message) in NO_RETRY:
+            return(1)
+        return(self.retries + 1)
+
+    def wait(self, message):
+        # seconds to wait for the reply to 'message'
+        if self.timeout != None and message_opcode(message) in SLOW:
+            return(self.timeout * self.slow)
+        return(self.timeout)
+
+    def delay(self, retry):
+        # seconds to sleep before 'retry' (0 for the first)
+        return(self.backoff * (self.factor ** retry))
+
+def sysex(packet):
+    # frame SysEx data as a complete message
+    return(b"\xf0" + bytes(packet) + b"\xf7")
+
+class Waiter(object):
+    # a request in flight, until its reply arrives
+    def __init__(self, message):
+        self.message = message
+        self.event = threading.Event()
+        self.reply = None
+        self.due = 0
+        self.candidate = None   # (due, message) from the pedal, unmatched
+
+class Dispatcher(object):
+    # Takes every message received from the transport (on its thread),
+    # handing it to the oldest request awaiting that opcode (see
+    # 'is_reply') or else to the subscribers and the queue read by
+    # receive(). Requests are registered and sent under one lock, so any
+    # number of threads can share the connection; the pedal answers in
+    # order, so replies to the same opcode are matched in order too.
+    # A SysEx from the pedal which matches nothing is kept by the oldest
+    # request, and taken as its reply if no other arrives in time.
+    backlog = 1000      # unsolicited messages kept, oldest dropped first
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.lock = threading.RLock()
+        self.pending = []
+        self.subscribers = []
+        self.unsolicited = queue.Queue(self.backlog)
+        transport.set_receiver(self._received)
+
+    def _received(self, message, delay):
+        with self.lock:
+            for waiter in self.pending:
+                if is_reply(waiter.message, message):
+                    self.pending.remove(waiter)
+                    waiter.due = monotonic() + delay
+                    waiter.reply = message
+                    waiter.event.set()
+                    return
+            if self.pending and from_pedal(message):
+                waiter = self.pending[0]
+                if waiter.candidate == None:
+                    waiter.candidate = (monotonic() + delay, message)
+                    waiter.event.set()
+                else:
+                    log_unmatched(waiter.message, message)
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            subscriber(message)
+
+        while True:
+            try:
+                self.unsolicited.put_nowait((monotonic() + delay, message))
+                break
+            except queue.Full:
+                try:
+                    self.unsolicited.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def subscribe(self, callback):
+        # 'callback(message)' for messages which are not replies, called
+        # from the transport's thread so it should not block
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            self.subscribers.remove(callback)
+
+    def send(self, message):
+        # send without expecting a reply
+        with self.lock:
+            self.transport.send(message)
+
+    def submit(self, message):
+        # send request, returning Waiter for its reply
+        waiter = Waiter(message)
+        with self.lock:
+            self.pending.append(waiter)
+            self.transport.send(message)
+        return(waiter)
+
+    def wait(self, waiter, timeout = None):
+        # reply to submitted request, or None if 'timeout' seconds pass
+        # (including a reply which is not due until after then). Without
+        # a 'timeout' an unmatched message from the pedal is taken at
+        # once, as it would have been without dispatching
+        if timeout != None:
+            deadline = monotonic() + timeout
+        while True:
+            remaining = None
+            if timeout != None:
+                remaining = max(deadline - monotonic(), 0)
+            waiter.event.wait(remaining)
+            with self.lock:
+                if waiter.reply != None:
+                    break
+                expired = timeout != None and monotonic() >= deadline
+                if waiter.candidate != None and (timeout == None or expired):
+                    log_unmatched(waiter.message, waiter.candidate[1], True)
+                    waiter.due, waiter.reply = waiter.candidate
+                if waiter.reply != None or expired:
+                    if waiter in self.pending:
+                        self.pending.remove(waiter)
+                    if waiter.reply == None:
+                        return(None)
+                    break
+                waiter.event.clear()
+
+        if timeout != None and waiter.due > deadline:
+            wait = deadline - monotonic()
+            if wait > 0:
+                sleep(wait)
+            return(None)
+        wait = waiter.due - monotonic()
+        if wait > 0:
+            sleep(wait)
+        return(waiter.reply)
+
+    def request(self, message, timeout = None):
+        return(self.wait(self.submit(message), timeout))
+
+    def receive(self, timeout = None):
+        # next unsolicited message, or None if 'timeout' seconds pass
+        try:
+            due, message = self.unsolicited.get(True, timeout)
+        except queue.Empty:
+            return(None)
+        wait = due - monotonic()
+        if wait > 0:
+            sleep(wait)
+        return(message)
+
+    def close(self):
+        self.transport.set_receiver(None)
+
 class zoomzt2(object):
-    inport = None
-    outport = None
+    transport = None
     editor = False
     pcmode = False
+    stall_timeout = 2.0     # seconds to wait for a pipelined reply
+    block_retries = 3       # attempts to re-fetch a block failing CRC
+    retry_count = None      # retries needed by last transfer of each file
+    listing = None          # files on device (name: size), once listed
+    stats = None            # Stats instance, when instrumented
+    dispatcher = None       # Dispatcher, when the connection is shared
+    policy = RetryPolicy(None)  # wait for ever, unless set (as the CLI does)
 
     def is_connected(self):
-        if self.inport == None or self.outport == None:
+        if self.transport == None:
             return(False)
         else:
             return(True)
 
-    def connect(self, midiskip = 0):
-        self.inport = None
-        skip = midiskip
-        for port in mido.get_input_names():
-            for midiname in midinames:
-                if port[:len(midiname)]==midiname:
-                    if not skip:
-                        self.inport = mido.open_input(port)
-                        break
-                    else:
-                        skip = skip - 1
-            if self.inport != None:
-                break
+    def connect(self, midiskip = 0, backend = "mido", capture = None, speed = 0):
+        # 'capture' records the session, or is replayed for "replay"
+        self.transport = zoomtransport.open_transport(midinames, midiskip,
+                backend, capture, speed)
+        self.listing = None
+        self.dispatcher = None
 
-        self.outport = None
-        skip = midiskip
-        for port in mido.get_output_names():
-            for midiname in midinames:
-                if port[:len(midiname)]==midiname:
-                    if not skip:
-                        self.outport = mido.open_output(port)
-                        break
-                    else:
-                        skip = skip - 1
-            if self.outport != None:
-                break
-
-        if self.inport == None or self.outport == None:
+        if self.transport == None:
             #print("Unable to find Pedal")
             return(False)
         return(True)
 
+    def attach(self, transport):
+        # use an already opened transport, ie. LoopbackTransport
+        self.transport = transport
+        self.listing = None
+        self.dispatcher = None
+
     def disconnect(self):
-        if self.pcmode:
-            self.pcmode_off()
+        # the connection is closed even if leaving PC mode fails
+        try:
+            if self.pcmode:
+                self.pcmode_off()
+        finally:
+            self.dispatch(False)
+            self.transport.close()
+            self.transport = None
+
+    def dispatch(self, on = True):
+        # match replies to requests by opcode, so that unsolicited
+        # messages (tuner, parameter changes) can arrive at any time and
+        # other threads can make requests or receive() on the same
+        # connection. Off, the next message is taken as the reply
+        if on and self.dispatcher == None:
+            self.dispatcher = Dispatcher(self.transport)
+        elif not on and self.dispatcher != None:
+            self.dispatcher.close()
+            self.dispatcher = None
+        return(self.dispatcher)
+
+    def channel(self):
+        if self.dispatcher == None:
+            return(self.transport)
+        return(self.dispatcher)
+
+    @contextlib.contextmanager
+    def retry(self, policy = None, **settings):
+        # requests within the 'with' statement use 'policy', or the
+        # current one with 'settings' changed, ie. retry(timeout=0.5)
+        saved = self.policy
+        if policy == None:
+            policy = saved.copy(**settings)
+        self.policy = policy
+        try:
+            yield policy
+        finally:
+            self.policy = saved
+
+    def request(self, message, policy = None):
+        # send pre-encoded message, return SysEx data of the reply
+        # (as a memoryview, so it is not copied). Raises ReplyTimeout
+        # when the (or the current) policy's attempts are used up
+        if policy == None:
+            policy = self.policy
+        attempts = policy.attempts(message)
+        timeout = policy.wait(message)
+
+        for attempt in range(attempts):
+            if attempt:
+                sleep(policy.delay(attempt - 1))
+
+            if self.stats == None:
+                reply = self._request(message, timeout)
+            else:
+                start = monotonic()
+                reply = self._request(message, timeout)
+                self.stats.request(message, reply, monotonic() - start)
+            if reply != None:
+                return(memoryview(reply)[1:-1])
+
+        raise ReplyTimeout(message, timeout, attempts)
+
+    def _request(self, message, timeout):
+        # whole reply, or None if 'timeout' seconds pass. Without
+        # dispatching, anything already received and messages which do
+        # not answer 'message' (late replies to a request which timed
+        # out, unsolicited ones) are dropped, keeping replies in step.
+        # The first unmatched SysEx from the pedal is still taken if no
+        # reply matches in time (at once without a 'timeout')
+        if self.dispatcher != None:
+            return(self.dispatcher.request(message, timeout))
 
-        self.inport = None
-        self.outport = None
+        while True:
+            stale = self.transport.receive(0)
+            if stale == None:
+                break
+            if from_pedal(stale):
+                log_unmatched(message, stale)
+        self.transport.send(message)
+
+        if timeout != None:
+            deadline = monotonic() + timeout
+        candidate = None
+        while True:
+            remaining = None
+            if timeout != None:
+                remaining = max(deadline - monotonic(), 0)
+            reply = self.transport.receive(remaining)
+            if reply != None and is_reply(message, reply):
+                return(reply)
+            if reply != None and from_pedal(reply):
+                if candidate == None:
+                    candidate = reply
+                else:
+                    log_unmatched(message, reply)
+            if timeout == None and candidate != None or \
+                    reply == None or timeout != None and monotonic() >= deadline:
+                if candidate != None:
+                    log_unmatched(message, candidate, True)
+                return(candidate)
+
+    def send(self, message):
+        # send without waiting for a reply
+        if self.stats != None:
+            self.stats.send(message)
+        self.channel().send(message)
+
+    def receive(self, timeout = None):
+        # next message, only unsolicited ones when dispatching
+        message = self.channel().receive(timeout)
+        if self.stats != None:
+            self.stats.receive(message)
+        return(message)
+
+    def submit(self, message):
+        # send request without waiting, returns handle for wait()
+        if self.dispatcher == None:
+            self.send(message)
+            return(None)
+        if self.stats != None:
+            self.stats.send(message)
+        return(self.dispatcher.submit(message))
+
+    def wait(self, handle, timeout = None):
+        # whole reply to a submit(), or None if 'timeout' seconds pass;
+        # without dispatching replies must be waited for in order
+        if handle == None:
+            return(self.receive(timeout))
+        message = self.dispatcher.wait(handle, timeout)
+        if self.stats != None:
+            self.stats.receive(message)
+        return(message)
 
     def pcmode_on(self):
         # Enable PC Mode
-        msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x52])
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        self.request(PCMODE_ON)
         self.pcmode = True
 
     def pcmode_off(self):
         # Disable PC Mode
-        msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x53])
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        self.request(PCMODE_OFF)
         self.pcmode = False
 
     def editor_on(self):
         # Enable Editor Mode
-        msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x50])
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        self.request(EDITOR_ON)
         self.editor = True
 
     def editor_off(self):
         # Disable Editor Mode
-        msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x51])
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        self.request(EDITOR_OFF)
         self.editor = False
 
     def pack(self, data):
         # Pack 8bit data into 7bit, MSB's in first byte followed
         # by 7 bytes (bits 6..0).
-        packet = bytearray(b"")
-        encode = bytearray(b"\x00")
-
-        for byte in data:
-            encode[0] = encode[0] + ((byte & 0x80) >> len(encode))
-            encode.append(byte & 0x7f)
-
-            if len(encode) > 7:
-                packet = packet + encode
-                encode = bytearray(b"\x00")
-
-        # don't forget to add last few bytes
-        if len(encode) > 1:
-            packet = packet + encode
-
+        if self.stats == None:
+            return(zoomcodec.pack(data))
+        start = monotonic()
+        packet = zoomcodec.pack(data)
+        self.stats.timer("pack", monotonic() - start, len(data))
         return(packet)
 
     def unpack(self, packet):
         # Unpack data 7bit to 8bit, MSBs in first byte
-        data = bytearray(b"")
-        loop = -1
-        hibits = 0
-
-        for byte in packet:
-            if loop !=-1:
-                if (hibits & (2**loop)):
-                    data.append(128 + byte)
-                else:
-                    data.append(byte)
-                loop = loop - 1
-            else:
-                hibits = byte
-                # do we need to acount for short sets (at end of block block)?
-                loop = 6
-
+        if self.stats == None:
+            return(zoomcodec.unpack(packet))
+        start = monotonic()
+        data = zoomcodec.unpack(packet)
+        self.stats.timer("unpack", monotonic() - start, len(packet))
         return(data)
 
-    def add_effect(self, data, name, version, id, installed=True):
-        config = ZT2.parse(data)
-        head, tail = os.path.split(name)
-        
-        group_new = (id & 0xFF000000) >> 24
-        group_found = False
+    def crc32(self, data):
+        # CRC32 of 8bit data, to compare with 'zoomcodec.checksum_value()'
+        if self.stats == None:
+            return(binascii.crc32(data))
+        start = monotonic()
+        crc = binascii.crc32(data)
+        self.stats.timer("crc32", monotonic() - start, len(data))
+        return(crc)
+
+    def checksum(self, data):
+        # CRC32 of 8bit data, encoded for sending
+        if self.stats == None:
+            return(zoomcodec.checksum(data))
+        start = monotonic()
+        crc = zoomcodec.checksum(data)
+        self.stats.timer("crc32", monotonic() - start, len(data))
+        return(crc)
 
-        for group in config[1]:
-            if group['group'] == group_new:
-                group_found = True
-                effects = group['effects']
-                slice = 0
-                for effect in effects:
-                    if effect['effect'] == tail:
-                        del effects[slice]
-                    slice = slice + 1
-
-                new = dict(effect=tail, version=version, id=id, installed=installed)
-                effects.append(new)
-
-        if not group_found:
-            effects = []
-            new = dict(effect=tail, version=version, id=id, installed=installed, group=group_new)
-            effects.append(new)
-            new = dict(group=group_new, groupname=group_new, effects=effects, groupend=group_new)
-            config[1].append(new)
-
-        return ZT2.build(config)
+    def add_effect(self, data, name, version, id, installed=True):
+        model = FlstModel(data)
+        model.add(name, version, id, installed)
+        return model.data()
 
     def add_effect_from_filename(self, data, name):
         binfile = open(name, "rb")
@@ -362,164 +1163,335 @@ class zoomzt2(object):
             bindata = binfile.read()
             binfile.close()
 
-            binconfig = ZD2.parse(bindata)
+            version, id = zd2_header(bindata)
             head, tail = os.path.split(name)
 
-            return self.add_effect(data, tail, binconfig['version'], binconfig['id'])
+            return self.add_effect(data, tail, version, id)
         return data
 
 
     def remove_effect(self, data, name):
-        config = ZT2.parse(data)
-        head, tail = os.path.split(name)
-        
-        for group in config[1]:
-            effects = group['effects']
-            slice = 0
-            for effect in effects:
-                if effect['effect'] == tail:
-                    del effects[slice]
-                slice = slice + 1
-
-        return ZT2.build(config)
+        model = FlstModel(data)
+        model.remove(name)
+        return model.data()
 
-    def filename(self, packet, name):
-        # send filename (with different packet headers)
+    def filename_message(self, packet, name):
+        # complete request with filename (with different packet headers)
         head, tail = os.path.split(name)
         for x in range(len(tail)):
             packet.append(ord(tail[x]))
         packet.append(0x00)
 
-        msg = mido.Message("sysex", data = packet)
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
-        return(msg)
+        return(sysex(packet))
+
+    def filename(self, packet, name):
+        # send filename (with different packet headers)
+        return(self.request(self.filename_message(packet, name)))
+
+    def found_decode(self, packet):
+        # decode reply to a find, returns (name, size) or None
+        if packet[4] != 4:
+            return(None)
+        end = bytes(packet[14:27]).find(b"\x00")
+        if end <= 0:
+            return(None)
+        return(bytes(packet[14:14 + end]).decode("utf-8"),
+                sum(packet[6 + x] << (7 * x) for x in range(5)))
 
     def file_check(self, name):
         # check file is present on device
-        packet = bytearray(b"\x52\x00\x6e\x60\x25\x00\x00")
         head, tail = os.path.split(name)
+        if self.listing != None:
+            return(tail in self.listing)
+
+        packet = bytearray(b"\x52\x00\x6e\x60\x25\x00\x00")
         self.filename(packet, tail)
 
-        msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x60, 0x05, 0x00])
-        self.outport.send(msg); sleep(0); resp = self.inport.receive()
-        
-        msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x60, 0x27])
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        resp = self.request(FILE_STATUS)
+        self.request(FILE_FIND_CLOSE)
 
-        if bytes(resp.data[-5:]) == b'\x00\x00\x00\x00\x00':
+        if bytes(resp[-5:]) == b'\x00\x00\x00\x00\x00':
             return(True)
         return(False)
     
+    def file_size(self, name):
+        # size of file on device, or None if not present
+        head, tail = os.path.split(name)
+        if self.listing != None:
+            if tail not in self.listing:
+                return(None)
+            if self.listing[tail] != None:
+                return(self.listing[tail])
+
+        packet = bytearray(b"\x52\x00\x6e\x60\x25\x00\x00")
+        packet = self.filename(packet, tail)
+        self.request(FILE_FIND_CLOSE)
+
+        found = self.found_decode(packet)
+        if found == None:
+            return(None)
+        return(found[1])
+
     def file_wild(self, first):
         if first:
             packet = bytearray(b"\x52\x00\x6e\x60\x25\x00\x00")
         else:
             packet = bytearray(b"\x52\x00\x6e\x60\x26\x00\x00")
-        msg = self.filename(packet, "*")
+        packet = self.filename(packet, "*")
 
-        if msg.data[4] == 4:
+        if packet[4] == 4:
             for x in range(14,27):
-                if msg.data[x] == 0:
-                    return bytes(msg.data[14:x]).decode("utf-8")
+                if packet[x] == 0:
+                    return bytes(packet[14:x]).decode("utf-8")
         else:
             return ""
 
-    def file_download(self, name):
-        # download file from pedal to PC
+    def file_list(self, refresh = False):
+        # names of files on device, listed once per connection and then
+        # kept in step with our own uploads and deletes
+        if self.listing == None or refresh:
+            self.listing = {}
+            packet = bytearray(b"\x52\x00\x6e\x60\x25\x00\x00")
+            while True:
+                found = self.found_decode(self.filename(packet, "*"))
+                if found == None:
+                    break
+                self.listing[found[0]] = found[1]
+                packet = bytearray(b"\x52\x00\x6e\x60\x26\x00\x00")
+            self.request(FILE_FIND_CLOSE)
+        return(list(self.listing))
+
+    def file_refresh(self):
+        # forget the listing, ie. after files were changed by other means
+        self.listing = None
+
+    def file_listed(self, name, size = None):
+        # record file as present on device ('size' None if not known yet)
+        if self.listing != None:
+            head, tail = os.path.split(name)
+            self.listing[tail] = size
+
+    def iter_download(self, name, skip = 0):
+        # download file from pedal, yielding each verified block
+        # 'skip' blocks are read on the pedal, but not fetched
         packet = bytearray(b"\x52\x00\x6e\x60\x20\x02\x00\x00\x00\x00\x00\x00\x00\x00\x00")
         head, tail = os.path.split(name)
         self.filename(packet, tail)
 
-        msg = mido.Message("sysex", data = packet)
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        self.request(sysex(packet))
         
+        if self.retry_count == None:
+            self.retry_count = {}
+        self.retry_count[tail] = 0
+
+        for x in range(skip):
+            self.request(FILE_READ)
+
         # Read parts 1 through 17 - refers to FLST_SEQ, possibly larger
-        data = bytearray(b"")
         while True:
-            msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x60, 0x05, 0x00])
-            self.outport.send(msg); sleep(0); msg = self.inport.receive()
-
-            msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x60, 0x22, 0x14, 0x2f, 0x60, 0x00, 0x0c, 0x00, 0x04, 0x00, 0x00, 0x00])
-            self.outport.send(msg); sleep(0); msg = self.inport.receive()
+            self.request(FILE_STATUS)
+            self.request(FILE_READ)
+            packet = self.request(FILE_STATUS)
+
+            attempt = 0
+            while True:
+                block, retry = self.block_verify(packet, tail, attempt)
+                if not retry:
+                    break
+                attempt = attempt + 1
+                packet = self.request(FILE_STATUS)
+
+            if block == None:
+                return
+            yield block
+
+    def block_verify(self, packet, name, attempt):
+        # check block fetched by 'attempt' (0 for the first), returns
+        # (data, False) when good, (None, False) at end of file or
+        # (None, True) when it fails its CRC: the pedal holds the block
+        # until the next read, so fetch it again with FILE_STATUS
+        block, valid = self.block_decode(packet)
+        if block == None or valid:
+            return(block, False)
+
+        if attempt == self.block_retries:
+            raise ChecksumError("Checksum error on \"%s\", after %d retries" \
+                    % (name, attempt))
+        checksum = zoomcodec.checksum_value(packet)
+        print("Checksum error", hex(checksum ^ 0xFFFFFFFF), "retrying")
+        if self.retry_count == None:
+            self.retry_count = {}
+        self.retry_count[name] = self.retry_count.get(name, 0) + 1
+        return(None, True)
+
+    def block_decode(self, packet):
+        # decode block read from file, returns (data, checksum is good)
+        # or (None, True) at end of file
+        length = int(packet[9]) * 128 + int(packet[8])
+        if packet[4] != 4 or length == 0:
+            return(None, True)
+        block = self.unpack(packet[10:10 + length + int(length/7) + 1])
 
-            msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x60, 0x05, 0x00])
-            self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        # confirm checksum (last 5 bytes of packet)
+        # note: SysEx prefix/postfix already removed
+        checksum = zoomcodec.checksum_value(packet)
+        return(block, checksum == self.crc32(block))
 
-            #decode received data
-            packet = msg.data
-            length = int(packet[9]) * 128 + int(packet[8])
-            if packet[4] != 4 or length == 0:
-                break
-            block = self.unpack(packet[10:10 + length + int(length/7) + 1])
-
-            # confirm checksum (last 5 bytes of packet)
-            # note: mido packet does not have SysEx prefix/postfix
-            checksum = packet[-5] + (packet[-4] << 7) + (packet[-3] << 14) \
-                    + (packet[-2] << 21) + ((packet[-1] & 0x0F) << 28) 
-            if (checksum ^ 0xFFFFFFFF) == binascii.crc32(block):
-                data = data + block
-            else:
-                print("Checksum error", hex(checksum))
+    def file_download(self, name):
+        # download file from pedal to PC
+        data = bytearray(b"")
+        for block in self.iter_download(name):
+            data += block
         return(data)
 
-    def file_upload(self, name, data):
-        packet = bytearray(b"\x52\x00\x6e\x60\x24")
-        head, tail = os.path.split(name)
-        self.filename(packet, tail)
+    def file_download_to(self, name, outfile):
+        # download file from pedal, writing blocks to 'outfile' as
+        # they arrive; returns number of bytes written
+        length = 0
+        for block in self.iter_download(name):
+            outfile.write(block)
+            length = length + len(block)
+        return(length)
+
+    def file_open_write(self, name, append = False):
+        # without 'append' any existing file is deleted first, as
+        # opening for write adds to the end of an existing file
+        if not append:
+            packet = bytearray(b"\x52\x00\x6e\x60\x24")
+            head, tail = os.path.split(name)
+            self.filename(packet, tail)
 
         packet = bytearray(b"\x52\x00\x6e\x60\x20\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00")
         head, tail = os.path.split(name)
         self.filename(packet, tail)
+        self.file_listed(tail)
 
-        msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x60, 0x05, 0x00])
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        self.request(FILE_STATUS)
 
-        while len(data):
-            packet = bytearray(b"\x52\x00\x6e\x60\x23\x40\x00\x00\x00\x00")
-            if len(data) > 512:
-                length = 512
-            else:
-                length = len(data)
-            packet.append(length & 0x7f)
-            packet.append((length >> 7) & 0x7f)
-            packet = packet + bytearray(b"\x00\x00\x00")
+    def file_block(self, data):
+        # build write request for (upto 512 bytes) block of data
+        packet = bytearray(b"\xf0\x52\x00\x6e\x60\x23\x40\x00\x00\x00\x00")
+        length = len(data)
+        packet.append(length & 0x7f)
+        packet.append((length >> 7) & 0x7f)
+        packet += b"\x00\x00\x00"
+
+        packet += self.pack(data)
 
-            packet = packet + self.pack(data[:length])
+        # Compute CRC32
+        packet += self.checksum(data)
+        packet.append(0xf7)
+        #print(hex(len(packet)), binascii.hexlify(packet))
+
+        return(packet)
+
+    def file_upload(self, name, data, window = 1):
+        # 'window' > 1 keeps that many blocks in flight, falling back
+        # to lock-step if the pedal rejects a block or stops answering
+        self.file_open_write(name)
+
+        if window > 1:
+            if self.file_upload_pipelined(data, window):
+                self.file_listed(name, len(data))
+                return
+            print("Pipelined upload failed, retrying lock-step")
+            self.file_close()
+            self.file_open_write(name)
+
+        view = memoryview(data)
+        for offset in range(0, len(view), 512):
+            self.request(self.file_block(view[offset:offset + 512]))
+            self.request(FILE_STATUS)
+        self.file_listed(name, len(view))
+
+    def file_upload_pipelined(self, data, window):
+        # replies arrive in order, each acknowledges the oldest block in
+        # flight; a non-zero status (last 5 bytes) is a rejection
+        view = memoryview(data)
+        offsets = range(0, len(view), 512)
+        inflight = []
+        sent = 0
+        acked = 0
+        failed = False
+
+        while acked < len(offsets):
+            while not failed and sent < len(offsets) and sent - acked < window:
+                offset = offsets[sent]
+                inflight.append(self.submit(self.file_block(view[offset:offset + 512])))
+                sent = sent + 1
+
+            reply = self.wait(inflight.pop(0), self.stall_timeout)
+            if reply == None:
+                failed = True
+                break
+            acked = acked + 1
+            if reply[-6:-1] != b"\x00\x00\x00\x00\x00":
+                failed = True
 
-            # Compute CRC32
-            crc = binascii.crc32(data[:length]) ^ 0xFFFFFFFF
-            packet.append(crc & 0x7f)
-            packet.append((crc >> 7) & 0x7f)
-            packet.append((crc >> 14) & 0x7f)
-            packet.append((crc >> 21) & 0x7f)
-            packet.append((crc >> 28) & 0x0f)
+            if failed and acked == sent:
+                break
 
-            data = data[length:]
-            #print(hex(len(packet)), binascii.hexlify(packet))
+        if failed:
+            # drain replies still in flight, so they are not
+            # mistaken for answers to later requests
+            while inflight:
+                if self.wait(inflight.pop(0), self.stall_timeout) == None:
+                    break
+            return(False)
 
-            msg = mido.Message("sysex", data = packet)
-            self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        self.request(FILE_STATUS)
+        return(True)
 
-            msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x60, 0x05, 0x00])
-            self.outport.send(msg); sleep(0); msg = self.inport.receive()
+    def file_upload_resume(self, name, data, journal):
+        # upload, recording acknowledged blocks in 'journal' so that an
+        # interrupted upload continues from where it stopped
+        view = memoryview(data)
+        offset, crc = journal.load()
+
+        if offset and (binascii.crc32(view[:offset]) != crc or \
+                self.file_size(name) != offset):
+            offset, crc = 0, 0
+        self.file_open_write(name, append = (offset != 0))
+
+        for offset in range(offset, len(view), 512):
+            block = view[offset:offset + 512]
+            self.request(self.file_block(block))
+
+            status = self.request(FILE_STATUS)
+            if bytes(status[-5:]) != b'\x00\x00\x00\x00\x00':
+                raise IOError("Block at offset %d of \"%s\" was rejected" \
+                        % (offset, name))
+
+            crc = binascii.crc32(block, crc)
+            journal.commit(offset + len(block), crc)
+
+        # resuming relies on the pedal appending to the existing file,
+        # so confirm it holds the whole upload before the journal goes
+        self.file_close()
+        size = self.file_size(name)
+        if size != len(view):
+            self.file_refresh()
+            raise IOError("\"%s\" is %s bytes on the pedal, expected %d" \
+                    % (os.path.basename(name), size, len(view)))
+        self.file_listed(name, len(view))
+        journal.remove()
 
     def file_delete(self, name):
         packet = bytearray(b"\x52\x00\x6e\x60\x24")
         head, tail = os.path.split(name)
         self.filename(packet, tail)
+        if self.listing != None:
+            self.listing.pop(tail, None)
 
     def file_close(self):
-        msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x60, 0x21, 0x40, 0x00, 0x00, 0x00, 0x00])
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
-        
-        msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x60, 0x09])
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        self.request(FILE_CLOSE)
+        self.request(FILE_FLUSH)
 
     def disk_usage(self):
-        msg = mido.Message("sysex", data = [0x52, 0x00, 0x6e, 0x60, 0x29, 0x00, 0x00, 0x00, 0x00, 0x00])
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        return(self.disk_usage_decode(self.request(DISK_USAGE)))
 
-        packet = bytes(msg.data)
+    def disk_usage_decode(self, packet):
+        packet = bytes(packet)
         #print(binascii.hexlify(packet))
         #b'52 00 6e 60 04 29 01 00 08 00 34 16 07 07 00 26 7c 12 04 00 00 0000000'
         #                          Max = XX XX XX XX XX,YY YY YY YY YY = Available
@@ -535,61 +1507,113 @@ class zoomzt2(object):
             return(0)
 
     def patch_check(self):
-        packet = bytearray(b"\x52\x00\x6e\x44")
-
-        msg = mido.Message("sysex", data = packet)
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        return(self.patch_check_decode(self.request(PATCH_CHECK)))
 
-        # decode received data
-        packet = msg.data
+    def patch_check_decode(self, packet):
+        # decode reply to PATCH_CHECK, returns (count, psize, bsize)
         count = packet[5] * 128 + packet[4]
         psize = packet[7] * 128 + packet[6]
         bsize = packet[11] * 128 + packet[10]
 
         return(count, psize, bsize)
 
-    def patch_download(self, location):
-        (count, psize, bsize) = self.patch_check()
-
-        packet = bytearray(b"\x52\x00\x6e\x46\x00\x00")
+    def patch_read_message(self, location, bsize, old = False):
+        # build request for patch at 'location' (1..count)
         bank = int((location - 1) / bsize)
         loc = location - (bank * bsize) - 1
 
-        packet.append(bank & 0x7F)
-        packet.append(bank >> 7)
-        packet.append(loc & 0x7F)
-        packet.append(loc >> 7)
-
-        msg = mido.Message("sysex", data = packet)
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
-
-        # decode received data
-        packet = msg.data
-        length = int(packet[11]) * 128 + int(packet[10])
+        if old:
+            packet = bytearray(b"\x52\x00\x6e\x09\x00")
+            packet.append(bank)
+            packet.append(loc)
+        else:
+            packet = bytearray(b"\x52\x00\x6e\x46\x00\x00")
+            packet.append(bank & 0x7F)
+            packet.append(bank >> 7)
+            packet.append(loc & 0x7F)
+            packet.append(loc >> 7)
+
+        return(sysex(packet))
+
+    def patch_decode(self, packet, old = False):
+        # decode patch from reply, returns (data, checksum is good)
+        if old:
+            start = 7
+        else:
+            start = 10
+        length = int(packet[start + 1]) * 128 + int(packet[start])
         if length == 0:
-            return()
-        data = self.unpack(packet[12:12 + length + int(length/7) + 1])
+            return(bytearray(b""), True)
+        data = self.unpack(packet[start + 2:start + 2 + length + int(length/7) + 1])
 
         # confirm checksum (last 5 bytes of packet)
-        checksum = packet[-5] + (packet[-4] << 7) + (packet[-3] << 14) \
-                + (packet[-2] << 21) + ((packet[-1] & 0x0F) << 28) 
+        checksum = zoomcodec.checksum_value(packet)
+        return(data, checksum == self.crc32(data))
 
-        if (checksum ^ 0xFFFFFFFF) != binascii.crc32(data):
-            print("Checksum error", hex(checksum))
+    def patch_download(self, location):
+        (count, psize, bsize) = self.patch_check()
+
+        packet = self.request(self.patch_read_message(location, bsize))
+        data, valid = self.patch_decode(packet)
+        if not valid:
+            print("Checksum error", hex(zoomcodec.checksum_value(packet) ^ 0xFFFFFFFF))
 
         return(data)
 
-    def patch_upload(self, location, data):
+    def patch_download_all(self, old = False, window = 1):
+        # download every patch, checking the layout only once; yields
+        # (location, data) with the CRC of each verified. 'window'
+        # requests are kept in flight, patches failing their CRC are
+        # fetched again afterwards (so may arrive out of order)
         (count, psize, bsize) = self.patch_check()
 
-        packet = bytearray(b"\x52\x00\x6e\x45\x00\x00")
+        failed = []
+        inflight = []
+        sent = 1
+        for location in range(1, count + 1):
+            while sent <= count and sent - location < window:
+                inflight.append(self.submit(self.patch_read_message(sent, bsize, old)))
+                sent = sent + 1
+
+            reply = self.wait(inflight.pop(0), self.stall_timeout)
+            if reply == None:
+                raise ReplyTimeout(self.patch_read_message(location, bsize, old),
+                        self.stall_timeout)
+            data, valid = self.patch_decode(memoryview(reply)[1:-1], old)
+            if valid:
+                yield (location, data)
+            else:
+                failed.append(location)
+
+        for location in failed:
+            attempt = 0
+            while True:
+                print("Checksum error on patch", location, "retrying")
+                attempt = attempt + 1
+                packet = self.request(self.patch_read_message(location, bsize, old))
+                data, valid = self.patch_decode(packet, old)
+                if valid:
+                    break
+                if attempt == self.block_retries:
+                    raise ChecksumError("Checksum error on patch %d, after %d retries" \
+                            % (location, attempt))
+            yield (location, data)
+
+    def patch_write_message(self, location, data, bsize, old = False):
+        # build upload of 'data' to patch at 'location' (1..count)
         bank = int((location - 1) / bsize)
         loc = location - (bank * bsize) - 1
 
-        packet.append(bank & 0x7F)
-        packet.append(bank >> 7)
-        packet.append(loc & 0x7F)
-        packet.append(loc >> 7)
+        if old:
+            packet = bytearray(b"\xf0\x52\x00\x6e\x08\x00")
+            packet.append(bank)
+            packet.append(loc)
+        else:
+            packet = bytearray(b"\xf0\x52\x00\x6e\x45\x00\x00")
+            packet.append(bank & 0x7F)
+            packet.append(bank >> 7)
+            packet.append(loc & 0x7F)
+            packet.append(loc >> 7)
 
         length = len(data)
         packet.append(length & 0x7f)
@@ -598,98 +1622,50 @@ class zoomzt2(object):
         packet = packet + self.pack(data[:length])
 
         # Compute CRC32
-        crc = binascii.crc32(data[:length]) ^ 0xFFFFFFFF
-        packet.append(crc & 0x7f)
-        packet.append((crc >> 7) & 0x7f)
-        packet.append((crc >> 14) & 0x7f)
-        packet.append((crc >> 21) & 0x7f)
-        packet.append((crc >> 28) & 0x0f)
+        packet = packet + self.checksum(data[:length])
+        packet.append(0xf7)
 
-        msg = mido.Message("sysex", data = packet)
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        return(packet)
 
-    def patch_download_old(self, location):
+    def patch_upload(self, location, data):
         (count, psize, bsize) = self.patch_check()
 
-        packet = bytearray(b"\x52\x00\x6e\x09\x00")
-        bank = int((location - 1) / bsize)
-        packet.append(bank)
-        packet.append(location - (bank * bsize) - 1)
-
-        msg = mido.Message("sysex", data = packet)
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
-
-        # decode received data
-        packet = msg.data
-        length = int(packet[8]) * 128 + int(packet[7])
-        if length == 0:
-            return()
-        data = self.unpack(packet[9:9 + length + int(length/7) + 1])
+        self.request(self.patch_write_message(location, data, bsize))
 
-        # confirm checksum (last 5 bytes of packet)
-        checksum = packet[-5] + (packet[-4] << 7) + (packet[-3] << 14) \
-                + (packet[-2] << 21) + ((packet[-1] & 0x0F) << 28) 
+    def patch_download_old(self, location):
+        (count, psize, bsize) = self.patch_check()
 
-        if (checksum ^ 0xFFFFFFFF) != binascii.crc32(data):
-            print("Checksum error", hex(checksum))
+        packet = self.request(self.patch_read_message(location, bsize, True))
+        data, valid = self.patch_decode(packet, True)
+        if not valid:
+            print("Checksum error", hex(zoomcodec.checksum_value(packet) ^ 0xFFFFFFFF))
 
         return(data)
 
     def patch_upload_old(self, location, data):
         (count, psize, bsize) = self.patch_check()
 
-        packet = bytearray(b"\x52\x00\x6e\x08\x00")
-        bank = int((location - 1) / bsize)
-        packet.append(bank)
-        packet.append(location - (bank * bsize) - 1)
-
-        length = len(data)
-        packet.append(length & 0x7f)
-        packet.append((length >> 7) & 0x7f)
-
-        packet = packet + self.pack(data[:length])
-
-        # Compute CRC32
-        crc = binascii.crc32(data[:length]) ^ 0xFFFFFFFF
-        packet.append(crc & 0x7f)
-        packet.append((crc >> 7) & 0x7f)
-        packet.append((crc >> 14) & 0x7f)
-        packet.append((crc >> 21) & 0x7f)
-        packet.append((crc >> 28) & 0x0f)
-
-        msg = mido.Message("sysex", data = packet)
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
+        self.request(self.patch_write_message(location, data, bsize, True))
 
     def patch_download_current(self):
-        packet = bytearray(b"\x52\x00\x6e\x64\x13")
-
-        msg = mido.Message("sysex", data = packet)
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
-
         # decode received data
-        packet = msg.data
+        packet = self.request(PATCH_CURRENT)
         length = int(packet[7]) * 128 + int(packet[6])
         if length == 0:
             return()
         data = self.unpack(packet[8:8 + length + int(length/7) + 1])
 
         # confirm checksum (last 5 bytes of packet)
-        checksum = packet[-5] + (packet[-4] << 7) + (packet[-3] << 14) \
-                + (packet[-2] << 21) + ((packet[-1] & 0x0F) << 28) 
+        checksum = zoomcodec.checksum_value(packet)
 
-        if (checksum ^ 0xFFFFFFFF) != binascii.crc32(data):
-            print("Checksum error", hex(checksum))
+        if checksum != self.crc32(data):
+            print("Checksum error", hex(checksum ^ 0xFFFFFFFF))
 
         return(data)
 
     def patch_download_current_old(self):
-        packet = bytearray(b"\x52\x00\x6e\x29")
-
-        msg = mido.Message("sysex", data = packet)
-        self.outport.send(msg); sleep(0); msg = self.inport.receive()
-
         # decode received data
-        packet = msg.data
+        packet = self.request(PATCH_CURRENT_OLD)
         data = self.unpack(packet[4:])
 
         return(data)
@@ -700,66 +1676,962 @@ class zoomzt2(object):
     '''
 
     def tuner(self, on = 0):
-        packet = bytearray(b"\x52\x00\x6e\x64")
-
         if on:
-            packet.append(0x0b)
+            self.send(TUNER_ON)
         else:
-            packet.append(0x0c)
-
-        msg = mido.Message("sysex", data = packet)
-        self.outport.send(msg); #sleep(0); msg = self.inport.receive()
+            self.send(TUNER_OFF)
 
     def tuner_read(self):
         note = None
         delta = 0
 
-        notes = ["A", "A#", "B", "C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "-"]
-
-        for msg in self.inport.iter_pending():
-            if msg.type == "control_change":
-                if msg.control == 98:
-                    if msg.value < 13:
-                        note = notes[msg.value]
-                if msg.control == 99:
-                    delta = msg.value - 8
+        message = self.receive(0)
+        while message != None:
+            if message[0] & 0xF0 == 0xB0:
+                if message[1] == 98:
+                    if message[2] < 13:
+                        note = TUNER_NOTES[message[2]]
+                if message[1] == 99:
+                    delta = message[2] - 8
+            message = self.receive(0)
 
         return(note, delta)
 
+    def screen_dump(self, first = 0, last = 9, values_only = False):
+        # request what the pedal displays for screens 'first'..'last',
+        # returns SysEx data of the reply (see 'decode_screens.py')
+        packet = bytearray(b"\x52\x00\x6e\x64\x02")
+        packet.append(first)
+        packet.append(last)
+        packet.append(1 if values_only else 0)
+        return(self.request(sysex(packet)))
+
+    def screen_listen(self, callback, first = 0, last = 9, interval = 0):
+        # call 'callback(screen, param, name, value)' for each parameter
+        # as it changes, stop() the returned listener before making other
+        # requests (unless dispatching) or disconnecting
+        return(ScreenListener(self, callback, first, last, interval))
+
+    def tuner_listen(self, callback):
+        # call 'callback(note, delta)' as tuner readings arrive, rather
+        # than polling tuner_read(); stop() the returned listener before
+        # making other requests (unless dispatching) or disconnecting
+        return(TunerListener(self, callback))
+
+class ScreenListener(object):
+    # Requests screen dumps back to back (or every 'interval' seconds)
+    # from its own thread, decoding the records of each as a stream and
+    # calling back only for parameters that changed. Unchanged dumps are
+    # skipped without decoding.
+    def __init__(self, pedal, callback, first = 0, last = 9, interval = 0):
+        import decode_screens
+
+        self.pedal = pedal
+        self.callback = callback
+        self.first = first
+        self.last = last
+        self.interval = interval
+        self.state = decode_screens.ScreenState()
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        # names are only needed again when an effect changes (param 0
+        # is on/off, 1 the effect's name), otherwise values are enough
+        values_only = False
+        while self.running and self.pedal.is_connected():
+            data = self.pedal.screen_dump(self.first, self.last, values_only)
+
+            saved = dict(self.state.params)
+            changes = list(self.state.update(data))
+            if values_only and [change for change in changes if change[1] < 2]:
+                # effect changed, fetch again with names before reporting
+                self.state.params = saved
+                self.state.last = None
+                values_only = False
+                continue
+            values_only = True
+
+            for change in changes:
+                self.callback(*change)
+            if self.interval:
+                sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        if self.thread != threading.current_thread():
+            self.thread.join()
+
+class TunerListener(object):
+    # Decodes tuner CC98 (note)/CC99 (delta) as soon as each arrives,
+    # from its own thread blocked on the pedal's input. Messages already
+    # waiting are drained first, so a burst results in a single call
+    # with the latest reading.
+    wakeup = 0.5        # seconds between checks for stop()
+
+    def __init__(self, pedal, callback):
+        self.pedal = pedal
+        self.callback = callback
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        note = None
+        delta = 0
+
+        while self.running and self.pedal.is_connected():
+            message = self.pedal.receive(self.wakeup)
+            updated = False
+            while message != None:
+                if message[0] & 0xF0 == 0xB0:
+                    if message[1] == 98 and message[2] < 13:
+                        note = TUNER_NOTES[message[2]]
+                        updated = True
+                    if message[1] == 99:
+                        delta = message[2] - 8
+                        updated = True
+                message = self.pedal.receive(0)
+
+            if updated and self.running:
+                self.callback(note, delta)
+
+    def stop(self):
+        self.running = False
+        if self.thread != threading.current_thread():
+            self.thread.join()
+
 #--------------------------------------------------
+# Edit a parsed FLST_SEQ (ZT2) config
+
+class FlstModel(object):
+    # FLST_SEQ config with its effects indexed by name, id and group, so
+    # add/remove/toggle/move are dictionary operations rather than scans
+    # of every group. Effects are kept in order per group, the 'effects'
+    # lists of groups which changed are rebuilt by sync() (or data()).
+    # Names are the files on the pedal so must be unique, a config
+    # listing one twice is refused rather than losing an entry
+    def __init__(self, data = None):
+        self.config = None
+        self.names = {}         # name: effect
+        self.ids = {}           # id: effect
+        self.groups = {}        # group: OrderedDict of name: effect
+        self.containers = {}    # group: its container in config
+        self.changed = set()
+        if data:
+            self.load(data)
+
+    def load(self, data):
+        self.index(zt2_parse(data))
+
+    def index(self, config):
+        # use an already parsed config, which is then edited in place
+        self.config = config
+        self.names = {}
+        self.ids = {}
+        self.groups = {}
+        self.containers = {}
+        self.changed = set()
+        for group in config[1]:
+            effects = collections.OrderedDict()
+            for effect in group['effects']:
+                if effect['effect'] in self.names:
+                    raise ValueError("\"%s\" is listed more than once" \
+                            % effect['effect'])
+                effects[effect['effect']] = effect
+                self.names[effect['effect']] = effect
+                self.ids[effect['id']] = effect
+            self.groups[group['group']] = effects
+            self.containers[group['group']] = group
+
+    def sync(self):
+        for number in self.changed:
+            self.containers[number]['effects'] = ListContainer(self.groups[number].values())
+        self.changed = set()
+
+    def data(self):
+        self.sync()
+        return(zt2_build(self.config))
+
+    def effects(self):
+        # all effects, in the order listed
+        self.sync()
+        for group in self.config[1]:
+            for effect in group['effects']:
+                yield effect
+
+    def find(self, name):
+        # effect 'name', or None
+        return(self.names.get(name))
+
+    def find_id(self, id):
+        return(self.ids.get(id))
+
+    def add(self, name, version, id, installed = True):
+        # add (or replace) effect, at the end of its group
+        head, tail = os.path.split(name)
+        self.remove(tail)
+
+        number = (id & 0xFF000000) >> 24
+        if number not in self.groups:
+            group = Container(group=number, groupname=group_name(number),
+                    effects=ListContainer(), group_end=number)
+            self.config[1].append(group)
+            self.groups[number] = collections.OrderedDict()
+            self.containers[number] = group
+
+        effect = Container(effect=tail, version=version,
+                installed=1 if installed else 0, id=id, group=number)
+        self.groups[number][tail] = effect
+        self.names[tail] = effect
+        self.ids[id] = effect
+        self.changed.add(number)
+        return(effect)
+
+    def remove(self, name):
+        # returns True if effect was present
+        head, tail = os.path.split(name)
+        effect = self.names.pop(tail, None)
+        if effect == None:
+            return(False)
 
-def download_and_save_file(pedal, name, outname = ""):
-    data = bytearray(b"")
-    if pedal.file_check(name):
-        data = pedal.file_download(name)
-        pedal.file_close()
-    else:
-        print("File \"" + name + "\" was not found on the pedal" )
+        number = (effect['id'] & 0xFF000000) >> 24
+        del self.groups[number][tail]
+        if self.ids.get(effect['id']) is effect:
+            del self.ids[effect['id']]
+        self.changed.add(number)
+        return(True)
 
-    if data:
-        if outname == "":
-            outname = name
-        outfile = open(outname, "wb")
+    def toggle(self, name):
+        # flip installed state, returns new state (None if not present)
+        effect = self.names.get(name)
+        if effect == None:
+            return(None)
+        effect['installed'] = 0 if effect['installed'] else 1
+        return(effect['installed'])
+
+    def sort(self):
+        # put the effects of every group in order of id
+        for number, effects in self.groups.items():
+            ordered = sorted(effects.values(), key=lambda effect: effect['id'])
+            if list(effects.values()) != ordered:
+                self.groups[number] = collections.OrderedDict(
+                        (effect['effect'], effect) for effect in ordered)
+                self.changed.add(number)
+
+    def move(self, name, last = True):
+        # move effect to the end (or start) of its group
+        effect = self.names.get(name)
+        if effect != None:
+            number = (effect['id'] & 0xFF000000) >> 24
+            self.groups[number].move_to_end(name, last)
+            self.changed.add(number)
+
+    def apply(self, operations):
+        # apply list from read_operations(), in order
+        for operation in operations:
+            if operation[0] == "add":
+                self.add(operation[1], operation[2], operation[3], operation[4])
+            elif operation[0] == "delete":
+                self.remove(operation[1])
+            elif operation[0] == "toggle":
+                self.toggle(operation[1])
+
+def parse_id(text):
+    # effect id, as given to --id
+    if text[:2] == "0x":
+        return(int(text, 16))
+    return(int(text))
+
+# command line options understood in an --apply file, ie. the output of
+# --build or the 'scripts/*.sh' lists
+APPLY_OPTIONS = {"-i": "id", "--id": "id", "-v": "ver", "--ver": "ver",
+        "-A": "add", "--add": "add", "-N": "notadd", "--not-add": "notadd",
+        "-D": "delete", "--delete": "delete", "-t": "toggle", "--toggle": "toggle"}
+
+def _command_operations(words):
+    # operations of one 'python3 zoomzt2.py ...' line, in the order
+    # main() applies them
+    options = {}
+    position = 0
+    while position < len(words):
+        key = APPLY_OPTIONS.get(words[position])
+        if key and position + 1 < len(words):
+            options[key] = words[position + 1]
+            position = position + 1
+        position = position + 1
+
+    operations = []
+    name = options.get("add") or options.get("notadd")
+    if name and options.get("ver") and options.get("id"):
+        operations.append(("add", name, options["ver"], parse_id(options["id"]),
+                "add" in options))
+    if options.get("delete"):
+        operations.append(("delete", options["delete"]))
+    if options.get("toggle"):
+        operations.append(("toggle", options["toggle"]))
+    return(operations)
+
+def read_operations(filename):
+    # list of FLST_SEQ edits, each ("add", name, version, id, installed),
+    # ("delete", name) or ("toggle", name). The file is either JSON, a
+    # list of objects with "op" ("add", "not-add", "delete" or "toggle")
+    # and "name"/"version"/"id" as needed, or text with a line for each:
+    #   add NAME VERSION ID
+    #   not-add NAME VERSION ID
+    #   delete NAME
+    #   toggle NAME
+    # or zoomzt2.py command lines, as output by --build
+    infile = open(filename, "r")
+    text = infile.read()
+    infile.close()
+
+    operations = []
+    if text.lstrip()[:1] == "[":
+        for entry in json.loads(text):
+            op = entry.get("op")
+            if op in ("add", "not-add"):
+                id = entry["id"]
+                if not isinstance(id, int):
+                    id = parse_id(id)
+                operations.append(("add", entry["name"], entry["version"], id,
+                        op == "add"))
+            elif op in ("delete", "toggle"):
+                operations.append((op, entry["name"]))
+            else:
+                raise ValueError("%s: unknown operation '%s'" % (filename, op))
+        return(operations)
+
+    for number, line in enumerate(text.splitlines()):
+        words = shlex.split(line, comments=True)
+        if not words:
+            continue
+        try:
+            if words[0] in ("add", "not-add") and len(words) == 4:
+                operations.append(("add", words[1], words[2], parse_id(words[3]),
+                        words[0] == "add"))
+            elif words[0] in ("delete", "toggle") and len(words) == 2:
+                operations.append((words[0], words[1]))
+            elif [word for word in words[:3] if word.endswith(".py")]:
+                operations.extend(_command_operations(words))
+            else:
+                raise ValueError("unknown operation")
+        except ValueError as error:
+            raise ValueError("%s:%d: %s" % (filename, number + 1, error))
+    return(operations)
+
+class FlstSession(object):
+    # FLST_SEQ.ZT2 read once (from pedal, unless 'data' is given) and
+    # edited in memory, then written back with a single upload - which
+    # is skipped if nothing changed
+    filename = "FLST_SEQ.ZT2"
+
+    def __init__(self, pedal, data = None):
+        self.pedal = pedal
+        if data == None:
+            self.download()
+        else:
+            self.set(data)
+
+    def set(self, data):
+        self.original = bytes(data)
+        self.model = None
+        if data:
+            self.model = FlstModel(data)
+
+    def download(self):
+        data = b""
+        if self.pedal.file_check(self.filename):
+            data = self.pedal.file_download(self.filename)
+        self.pedal.file_close()
+        self.set(data)
+
+    def data(self):
+        if self.model == None:
+            return(self.original)
+        return(self.model.data())
+
+    def add(self, name, version, id, installed=True):
+        if self.model != None:
+            self.model.add(name, version, id, installed)
+
+    def add_from_filename(self, name):
+        if self.model != None:
+            version, id = zd2_read_header(name)
+            self.add(name, version, id)
+
+    def add_from_dir(self, dirname):
+        # add every ZD2 effect in 'dirname', reading only their headers,
+        # and sort each group by id; starts from an empty FLST_SEQ if
+        # there is none. Files are recognised by content, so effects
+        # extracted without a '.ZD2' suffix are listed too; returns
+        # number added
+        if self.model == None:
+            self.model = FlstModel()
+            self.model.index(zt2_empty())
+
+        effects = []
+        for name in sorted(os.listdir(dirname)):
+            path = os.path.join(dirname, name)
+            if not os.path.isfile(path):
+                continue
+            try:
+                version, id = zd2_read_header(path)
+            except (IOError, ValueError) as error:
+                if os.path.splitext(name)[1].upper() == ".ZD2":
+                    print("Skipping \"%s\": %s" % (name, error))
+                continue
+            effects.append((id, name, version))
+
+        for id, name, version in effects:
+            self.model.add(name, version, id)
+        self.model.sort()
+        return(len(effects))
+
+    def remove(self, name):
+        if self.model != None:
+            self.model.remove(name)
+
+    def toggle(self, name):
+        if self.model != None:
+            self.model.toggle(name)
+
+    def apply(self, operations):
+        if self.model != None:
+            self.model.apply(operations)
+
+    def find(self, name):
+        # entry for effect 'name', or None
+        if self.model != None:
+            return(self.model.find(name))
+        return(None)
+
+    def commit(self, force = False):
+        # upload if changed (or forced), returns True if uploaded
+        data = self.data()
+        if not data or (data == self.original and not force):
+            return(False)
+
+        self.pedal.file_check(self.filename)
+        self.pedal.file_upload(self.filename, data)
+        self.pedal.file_close()
+        self.original = data
+        return(True)
+
+class Fleet(object):
+    # Drives every matching pedal at once, each with its own 'zoomzt2'
+    # (connected by index, as with 'midiskip') and worker thread, so a
+    # plan run across the fleet takes about as long as the slowest pedal.
+    def __init__(self, policy = None):
+        self.pedals = []
+        self.policy = policy
+
+    def connect(self, backend = "mido", count = None):
+        # connect to 'count' pedals (default all found), returns how many
+        if count == None:
+            count = zoomtransport.count_devices(midinames, backend)
+        for index in range(count):
+            pedal = zoomzt2()
+            if self.policy != None:
+                pedal.policy = self.policy
+            if not pedal.connect(index, backend):
+                break
+            self.pedals.append(pedal)
+        return(len(self.pedals))
+
+    def attach(self, transports):
+        # use already opened transports, ie. LoopbackTransport
+        for transport in transports:
+            pedal = zoomzt2()
+            if self.policy != None:
+                pedal.policy = self.policy
+            pedal.attach(transport)
+            self.pedals.append(pedal)
+
+    def disconnect(self):
+        # every pedal is disconnected, even if some fail to leave PC
+        # mode; returns list of (index, error) for those that did
+        errors = []
+        for index, pedal in enumerate(self.pedals):
+            try:
+                if pedal.is_connected():
+                    pedal.disconnect()
+            except Exception as error:
+                errors.append((index, error))
+        self.pedals = []
+        return(errors)
+
+    def run(self, plan, *args):
+        # call 'plan(pedal, index, *args)' for every pedal concurrently,
+        # returns list of (index, result, error) with error None unless
+        # the plan raised it
+        results = [None] * len(self.pedals)
+
+        def worker(index, pedal):
+            try:
+                results[index] = (index, plan(pedal, index, *args), None)
+            except Exception as error:
+                results[index] = (index, None, error)
+
+        threads = []
+        for index, pedal in enumerate(self.pedals):
+            thread = threading.Thread(target=worker, args=(index, pedal))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return(results)
+
+def fleet_path(path, index):
+    # path for the pedal numbered 'index' (as with '-M'), the first
+    # keeps 'backup.zip' and the others get 'backup-1.zip' and so on;
+    # used alone and with --fleet, so a pedal's files are the same
+    if not index:
+        return(path)
+    root, extension = os.path.splitext(path.rstrip(os.sep))
+    return("%s-%d%s" % (root, index, extension))
+
+def manifest_path(options, dirname, index = 0):
+    # manifest for the pedal numbered 'index', '--manifest' or else one
+    # kept in 'dirname' so pedals synced from it keep theirs apart
+    if options.manifest:
+        return(fleet_path(options.manifest, index))
+    return(os.path.join(dirname, fleet_path("zoomzt2.manifest", index)))
+
+#--------------------------------------------------
+
+def download_and_save_file(pedal, name, outname = "", resume = False):
+    # stream file from pedal to disk, returns number of bytes saved
+    length = 0
+    if not pedal.file_check(name):
+        print("File \"" + name + "\" was not found on the pedal" )
+        return length
+
+    if outname == "":
+        outname = name
+
+    if resume:
+        return download_and_save_file_resume(pedal, name, outname)
+
+    outfile = None
+    try:
+        for block in pedal.iter_download(name):
+            if not outfile:
+                try:
+                    outfile = open(outname, "wb")
+                except IOError:
+                    print("Unable to open FILE \"" + name + "\" for writing")
+                    break
+            outfile.write(block)
+            length = length + len(block)
+    except ChecksumError as error:
+        # don't leave a truncated copy behind
+        print(error)
         if outfile:
-            outfile.write(data)
             outfile.close()
-        else:
-            print("Unable to open FILE \"" + name + "\" for writing")
-    return data
+            os.remove(outname)
+            outfile = None
+        length = 0
+    pedal.file_close()
 
-def download_and_save_all_files(pedal, dirname):
-    files = []
-    name = pedal.file_wild(True)
+    if outfile:
+        outfile.close()
+    return length
+
+def download_and_save_file_resume(pedal, name, outname):
+    # download to 'FILE.part', journaling verified blocks so that an
+    # interrupted download only fetches the missing tail
+    # the size on the pedal is journaled, so that a file changed
+    # since is downloaded again rather than resumed
+    size = pedal.file_size(name)
+    journal = Journal(outname, name, "download", size)
+    partname = outname + ".part"
+    offset, crc = journal.load()
+
+    # confirm the partial copy is what the journal recorded
+    if offset and os.path.exists(partname):
+        infile = open(partname, "rb")
+        part = infile.read(offset)
+        infile.close()
+        if len(part) != offset or binascii.crc32(part) != crc:
+            offset = 0
+    else:
+        offset = 0
+
+    # restart from a whole block, as the pedal reads 512 at a time
+    offset = offset - (offset % 512)
+    if offset:
+        print("Resuming \"" + name + "\" from offset", offset)
+        crc = binascii.crc32(part[:offset])
+        outfile = open(partname, "r+b")
+        outfile.truncate(offset)
+        outfile.seek(offset)
+    else:
+        crc = 0
+        outfile = open(partname, "wb")
+
+    try:
+        for block in pedal.iter_download(name, skip = offset // 512):
+            outfile.write(block)
+            outfile.flush()
+            offset = offset + len(block)
+            crc = binascii.crc32(block, crc)
+            journal.commit(offset, crc)
+    except ChecksumError as error:
+        # keep the verified blocks for next time
+        print(error)
+        outfile.close()
+        pedal.file_close()
+        return 0
+    pedal.file_close()
+    outfile.close()
+
+    if offset != size:
+        # the file changed while downloading, start over next time
+        print("Downloaded %d bytes of \"%s\", expected %s" % (offset, name, size))
+        journal.commit(0, 0)
+        return 0
+    os.replace(partname, outname)
+    journal.remove()
+    return offset
+
+def upload_file(pedal, name, data, window = 1, resume = False):
+    if resume:
+        pedal.file_upload_resume(name, data, Journal(name, name, "upload", len(data)))
+    else:
+        pedal.file_upload(name, data, window)
 
-    while name:
-        files.append(name)
-        name = pedal.file_wild(False)
+def download_and_save_all_files(pedal, dirname, resume = False, manifest = None):
+    for name in pedal.file_list():
+        fullname = os.path.join(dirname, name)
+        if resume and os.path.exists(fullname) and \
+                os.path.getsize(fullname) == pedal.file_size(name):
+            print("Skipping file    " + name.ljust(12) + " (already downloaded)")
+        else:
+            print("Downloading file " + name.ljust(12) + " -> " + fullname)
+            download_and_save_file(pedal, name, fullname, resume)
 
-    for name in files:
+        if manifest and os.path.exists(fullname):
+            infile = open(fullname, "rb")
+            data = infile.read()
+            infile.close()
+            if len(data) == pedal.file_size(name):
+                manifest.record(name, data)
+
+    if manifest:
+        manifest.save()
+
+def save_all_patches(pedal, path, old = False, window = 1, manifest = None):
+    # back up every patch into a PatchArchive, returns number saved
+    archive = PatchArchive(path, "w")
+    try:
+        for location, data in pedal.patch_download_all(old, window):
+            archive.write(location, data)
+            if manifest:
+                manifest.record(archive.filename(location), data)
+    finally:
+        archive.close()
+        if manifest:
+            manifest.save()
+    return(len(archive.index))
+
+def restore_patches(pedal, path, manifest = None, old = False, window = 1,
+        trust = False):
+    # upload the patches in a PatchArchive which differ from the pedal,
+    # comparing size/CRC32 against a fresh download, or with 'trust'
+    # against 'manifest' (when it holds every patch) which misses any
+    # edits made on the pedal since; returns (uploaded, skipped, bytes
+    # of uploads skipped, patches downloaded to compare)
+    archive = PatchArchive(path)
+    (count, psize, bsize) = pedal.patch_check()
+
+    current = {}
+    if manifest and trust:
+        print("Warning: trusting the CRCs in \"%s\", patches edited on the pedal " \
+                "since will not be restored" % manifest.path)
+        current = manifest.files
+
+    downloaded = 0
+    locations = [location for location in archive.locations() if location <= count]
+    if [location for location in locations if archive.filename(location) not in current]:
+        current = {}
+        for location, data in pedal.patch_download_all(old, window):
+            current[archive.filename(location)] = dict(size=len(data),
+                    crc=binascii.crc32(data))
+            downloaded = downloaded + 1
+        if manifest:
+            manifest.files.update(current)
+
+    uploaded = 0
+    saved = 0
+    for location in locations:
+        entry = archive.index[location]
+        data = archive.read(location)
+        message = pedal.patch_write_message(location, data, bsize, old)
+
+        if current.get(archive.filename(location)) == dict(size=entry["size"], crc=entry["crc"]):
+            saved = saved + len(message)
+            continue
+
+        print("Uploading patch", location)
+        pedal.request(message)
+        uploaded = uploaded + 1
+        if manifest:
+            manifest.record(archive.filename(location), data)
+    archive.close()
+
+    if len(locations) < len(archive.index):
+        print("Pedal only has", count, "patches, ignored", \
+                len(archive.index) - len(locations), "from archive")
+    if manifest:
+        manifest.save()
+
+    return((uploaded, len(locations) - uploaded, saved, downloaded))
+
+def sync_files(pedal, dirname, manifest, orphans = False, window = 1):
+    # upload the effect files in 'dirname' which differ (by size and
+    # CRC32) from those recorded in 'manifest' for this pedal, optionally
+    # delete effect files not present locally, then reconcile FLST_SEQ
+    # with a single write; returns (uploaded, unchanged, deleted)
+    extensions = [".ZD2", ".ZIC", ".ZIR"]
+    uploaded = 0
+    deleted = 0
+
+    # anything the pedal disagrees with has changed behind our back
+    pedal.file_list()
+    for name in list(manifest.files):
+        filename, extension = os.path.splitext(name)
+        if extension.upper() in extensions and \
+                pedal.file_size(name) != manifest.files[name]["size"]:
+            manifest.forget(name)
+
+    session = FlstSession(pedal)
+
+    local = []
+    for name in sorted(os.listdir(dirname)):
         fullname = os.path.join(dirname, name)
-        print("Downloading file " + name.ljust(12) + " -> " + fullname)
-        download_and_save_file(pedal, name, fullname)
+        filename, extension = os.path.splitext(name)
+        if extension.upper() not in extensions or not os.path.isfile(fullname):
+            continue
+        local.append(name)
+
+        infile = open(fullname, "rb")
+        data = infile.read()
+        infile.close()
+
+        changed = not manifest.matches(name, data)
+        if changed:
+            print("Uploading file " + name.ljust(12))
+            upload_file(pedal, name, data, window)
+            pedal.file_close()
+            manifest.record(name, data)
+            manifest.save()
+            uploaded = uploaded + 1
+
+        if extension.upper() == ".ZD2":
+            effect = session.find(name)
+            if changed or effect == None:
+                version, id = zd2_header(data)
+                if effect == None or effect['version'] != version or effect['id'] != id:
+                    installed = True
+                    if effect != None:
+                        installed = effect['installed']
+                    session.add(name, version, id, installed)
+
+    if orphans:
+        for name in pedal.file_list():
+            filename, extension = os.path.splitext(name)
+            if extension.upper() not in extensions or name in local:
+                continue
+            print("Removing file  " + name.ljust(12))
+            pedal.file_delete(name)
+            pedal.file_close()
+            manifest.forget(name)
+            if extension.upper() == ".ZD2":
+                session.remove(name)
+            deleted = deleted + 1
+
+    if session.commit():
+        print("Updated FLST_SEQ")
+    manifest.save()
+
+    return((uploaded, len(local) - uploaded, deleted))
+
+def install_files(pedal, targets, session = None, zic = False, zir = False,
+        window = 1, resume = False, available = False):
+    # upload effect files (with their icons/IRs) not already on the
+    # pedal, adding them to 'session' (FlstSession) when given. The
+    # pedal is listed once, checks are answered from that
+    pedal.file_list()
+    for target in targets:
+        filename, extension = os.path.splitext(target)
+
+        if zir:
+            zirfilename = filename + ".ZIR"
+            if os.path.exists(zirfilename):
+                binfile = open(zirfilename, "rb")
+                if binfile:
+                    bindata = binfile.read()
+                    binfile.close()
+
+                    if not pedal.file_check(zirfilename):
+                        print("Uploading IR:", zirfilename)
+                        upload_file(pedal, zirfilename, bindata, window, resume)
+
+                    pedal.file_close()
+
+                    if available:
+                        print("Percentage disk use:", pedal.disk_usage())
+
+        if zic:
+            zicfilename = filename + ".ZIC"
+            if os.path.exists(zicfilename):
+                binfile = open(zicfilename, "rb")
+                if binfile:
+                    bindata = binfile.read()
+                    binfile.close()
+
+                    if not pedal.file_check(zicfilename):
+                        print("Uploading icon:", zicfilename)
+                        upload_file(pedal, zicfilename, bindata, window, resume)
+
+                    pedal.file_close()
+
+                    if available:
+                        print("Percentage disk use:", pedal.disk_usage())
+
+        binfile = open(target, "rb")
+        if binfile:
+            bindata = binfile.read()
+            binfile.close()
+
+            if not pedal.file_check(target):
+                print("Uploading effect:", target)
+                upload_file(pedal, target, bindata, window, resume)
+
+            pedal.file_close()
+
+            if available:
+                print("Percentage disk use:", pedal.disk_usage())
+
+            if session:
+                if extension != ".ZD2":
+                    print("'%s' is not 'ZD2', skipping install" % target)
+                else:
+                    print("Installing effect:", target)
+                    session.add_from_filename(target)
+
+def uninstall_files(pedal, targets, session = None, zic = False, zir = False,
+        available = False):
+    # delete effect files (with their icons/IRs) from the pedal,
+    # removing them from 'session' (FlstSession) when given
+    for target in targets:
+        filename, extension = os.path.splitext(target)
+
+        if session:
+            if extension != ".ZD2":
+                print("'%s' is not 'ZD2', skipping uninstall" % target)
+            else:
+                print("Uninstalling effect:", target)
+                session.remove(target)
 
+        if pedal.file_check(target):
+            print("Removing effect:", target)
+            pedal.file_delete(target)
+
+        pedal.file_close()
+
+        if available:
+            print("Percentage disk use:", pedal.disk_usage())
+
+        filename, extension = os.path.splitext(target)
+
+        if zic:
+            zicfilename = filename + ".ZIC"
+            if pedal.file_check(zicfilename):
+                print("Removing icon:", zicfilename)
+                pedal.file_delete(zicfilename)
+
+            pedal.file_close()
+
+            if available:
+                print("Percentage disk use:", pedal.disk_usage())
+
+        if zir:
+            zirfilename = filename + ".ZIR"
+            if pedal.file_check(zirfilename):
+                print("Removing IR:", zirfilename)
+                pedal.file_delete(zirfilename)
+
+            pedal.file_close()
+
+            if available:
+                print("Percentage disk use:", pedal.disk_usage())
+
+def fleet_plan(pedal, index, options):
+    # the actions of main() which can be run across a Fleet, 'index'
+    # keeps each pedal's outputs and manifests apart. Returns summary
+    pedal.pcmode_on()
+    summary = []
+
+    if options.sync:
+        dirname = options.files[0]
+        manifest = Manifest(manifest_path(options, dirname, index))
+        manifest.load()
+        summary.append("uploaded %d, unchanged %d, removed %d" \
+                % sync_files(pedal, dirname, manifest, options.orphans, options.window))
+
+    if options.downloadall:
+        dirname = fleet_path(options.files[0], index)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        manifest = None
+        if options.manifest:
+            manifest = Manifest(manifest_path(options, dirname, index))
+            manifest.load()
+        download_and_save_all_files(pedal, dirname, options.resume, manifest)
+        summary.append("downloaded to \"%s\"" % dirname)
+
+    if options.backup or options.restore:
+        manifest = None
+        if options.manifest:
+            manifest = Manifest(fleet_path(options.manifest, index))
+            manifest.load()
+
+    if options.backup:
+        path = fleet_path(options.files[0], index)
+        count = save_all_patches(pedal, path, options.oldpatch, options.window,
+                manifest)
+        summary.append("saved %d patches to \"%s\"" % (count, path))
+
+    if options.restore:
+        (uploaded, skipped, saved, downloaded) = restore_patches(pedal,
+                options.files[0], manifest, options.oldpatch, options.window,
+                options.trust)
+        summary.append("uploaded %d patches, skipped %d unchanged" % (uploaded, skipped))
+
+    if options.install or options.installonly or options.uninstall or options.uninstallonly:
+        session = None
+        if options.install or options.uninstall:
+            session = FlstSession(pedal)
+        if options.install or options.installonly:
+            install_files(pedal, options.files, session, options.includezic,
+                    options.includezir, options.window, options.resume)
+        else:
+            uninstall_files(pedal, options.files, session, options.includezic,
+                    options.includezir)
+        if session and session.commit():
+            summary.append("updated FLST_SEQ")
+        else:
+            summary.append("FLST_SEQ unchanged")
+
+    if options.available:
+        summary.append("disk use %s%%" % pedal.disk_usage())
+    return(", ".join(summary))
 
 def main():
     from argparse import ArgumentParser
@@ -775,6 +2647,23 @@ def main():
     parser.add_argument("-M", "--midiskip",
         type=int, default=0, dest="midiskip",
         help="Skip devices when connecting, ie when you have multiple pedals")
+    parser.add_argument("--fleet",
+        help="Run sync/download-all/install/uninstall or backup/restore on every pedal found, " + \
+            "at the same time. Outputs get the pedal's number appended, ie. FILE-1",
+        action="store_true", dest="fleet")
+    parser.add_argument("-T", "--transport",
+        choices=["mido", "rawmidi", "replay"], default="mido", dest="transport",
+        help="Method used to talk to the pedal (rawmidi is Linux only, replay plays back a --capture)")
+    parser.add_argument("--capture", dest="capture",
+        help="Record session with pedal to CAPTURE, or with '-T replay' play it back")
+    parser.add_argument("--speed", type=float, default=0, dest="speed",
+        help="Replay at SPEED times the recorded rate (default 0, without delays)")
+    parser.add_argument("--timeout", type=float, default=RetryPolicy().timeout, dest="timeout",
+        help="Seconds to wait for each reply from the pedal (default %(default)s, 10x for flush/delete)")
+    parser.add_argument("--retries", type=int, default=RetryPolicy().retries, dest="retries",
+        help="Times to repeat a request that got no reply (default %(default)s)")
+    parser.add_argument("--stats", dest="stats",
+        help="Write message counts/latencies and codec timings as JSON to STATS ('-' for stdout)")
 
     # attached device's effects
     zd2 = parser.add_argument_group("ZD2", "Process 'ZDL2' effect file(s)")
@@ -805,6 +2694,21 @@ def main():
     zd2x.add_argument("--download-all",
         help="Download all files on pedal to directory FILE",
         action="store_true", dest="downloadall")
+    zd2x.add_argument("--sync",
+        help="Upload effect files in directory FILE which differ from pedal, updating FLST_SEQ",
+        action="store_true", dest="sync")
+    zd2.add_argument("--delete-orphans",
+        help="With --sync, remove effect files on pedal which are not in directory FILE",
+        action="store_true", dest="orphans")
+    zd2.add_argument("--manifest", dest="manifest",
+        help="Manifest of files (default FILE/zoomzt2.manifest) and patches on pedal, with -M N or --fleet MANIFEST-N for pedal N")
+
+    zd2.add_argument("--window", type=int, default=1, dest="window",
+        help="Number of blocks kept in flight when uploading (pipelined)")
+
+    zd2.add_argument("--resume",
+        help="Resume interrupted transfers, using a journal kept next to the local file",
+        action="store_true", dest="resume")
 
     zd2.add_argument("-a", "--available",
         help="Print out the available diskspace after action",
@@ -821,7 +2725,14 @@ def main():
         help="upload specific zptc", dest="patchup")
     zptcx.add_argument("-c", "--curdown", action="store_true", 
         help="download current zptc", dest="curdown")
-
+    zptcx.add_argument("--backup", action="store_true",
+        help="download all patches to archive FILE (.zip, or directory)", dest="backup")
+    zptcx.add_argument("--restore", action="store_true",
+        help="upload patches from archive FILE which differ from those on pedal", dest="restore")
+
+    zptc.add_argument("--trust-manifest",
+        help="With --restore, compare against the CRCs in --manifest instead of downloading (misses edits made on the pedal)",
+        action="store_true", dest="trust")
     zptc.add_argument("--old-patch",
         help="Use the 'old' method for reading patches",
         action="store_true", dest="oldpatch")
@@ -856,7 +2767,7 @@ def main():
         help="delete effect from FLST_SEQ", dest="delete")
     zt2z.add_argument("-A", "--add",
         help="add effect to FLST_SEQ", dest="add")
-    zt2z.add_argument("-N", "--not-add", action="store_true",
+    zt2z.add_argument("-N", "--not-add",
         help="add effect to FLST_SEQ, but as uninstalled", dest="notadd")
     zt2.add_argument("-v", "--ver",
         help="effect version (use with --add/--not-add)", dest="ver")
@@ -865,6 +2776,10 @@ def main():
 
     zt2.add_argument("-t", "--toggle",
         help="toggle install/uninstall state of effect NAME in FLST_SEQ", dest="toggle")
+    zt2.add_argument("--apply", dest="apply",
+        help="apply add/not-add/delete/toggle operations listed in APPLY (text, JSON or --build output) to FLST_SEQ")
+    zt2.add_argument("--from-dir", dest="fromdir",
+        help="add every ZD2 effect in directory FROMDIR to FLST_SEQ (a new one if FILE does not exist), sorting each group by id")
 
     zt2.add_argument("-w", "--write", dest="write",
         help="write config/changes back to same file", action="store_true")
@@ -874,10 +2789,50 @@ def main():
     if not len(options.files):
         parser.error("FILE not specified")
 
+    if options.trust and not (options.restore and options.manifest):
+        parser.error("--trust-manifest needs --restore and --manifest")
+
+    pedal.policy = RetryPolicy(options.timeout, options.retries)
+
+    if options.stats:
+        # dump on every exit, as most actions end with sys.exit()
+        pedal.stats = Stats()
+        atexit.register(pedal.stats.dump, options.stats)
+
+    if options.fleet:
+        if not (options.sync or options.downloadall or options.install or \
+                options.installonly or options.uninstall or options.uninstallonly or \
+                options.backup or options.restore):
+            parser.error("--fleet needs one of --sync, --download-all, --install, " + \
+                    "--install-only, --uninstall, --uninstall-only, --backup or --restore")
+        if options.transport == "replay" or options.capture:
+            parser.error("--fleet can not be captured or replayed")
+
+        fleet = Fleet(pedal.policy)
+        if not fleet.connect(options.transport):
+            sys.exit("Unable to find Pedal")
+        print("Found", len(fleet.pedals), "pedals")
+
+        count = len(fleet.pedals)
+        failed = 0
+        for index, result, error in fleet.run(fleet_plan, options):
+            if error != None:
+                print("Pedal %d failed: %s" % (index, error))
+                failed = failed + 1
+            else:
+                print("Pedal %d: %s" % (index, result))
+        for index, error in fleet.disconnect():
+            print("Pedal %d failed to disconnect: %s" % (index, error))
+
+        if failed:
+            sys.exit("%d of %d pedals failed" % (failed, count))
+        sys.exit()
+
     if options.curdown:
         # do this first as we do not need PC mode,
         # which would cancel unsaved changes
-        if not pedal.connect(options.midiskip):
+        if not pedal.connect(options.midiskip, options.transport,
+                options.capture, options.speed):
             sys.exit("Unable to find Pedal")
 
         if options.oldpatch:
@@ -901,8 +2856,10 @@ def main():
             options.install or options.uninstall or \
             options.installonly or options.uninstallonly or \
             options.patchdown or options.patchup or \
-            options.effectdown or options.downloadall:
-        if not pedal.connect(options.midiskip):
+            options.effectdown or options.downloadall or options.sync or \
+            options.backup or options.restore:
+        if not pedal.connect(options.midiskip, options.transport,
+                options.capture, options.speed):
             sys.exit("Unable to find Pedal")
         else:
             pedal.pcmode_on()
@@ -949,21 +2906,51 @@ def main():
         pedal.disconnect()
         sys.exit()
 
+    if options.backup:
+        print("Saving all patches to \"" + options.files[0] + "\"")
+        manifest = None
+        if options.manifest:
+            manifest = Manifest(fleet_path(options.manifest, options.midiskip))
+            manifest.load()
+        count = save_all_patches(pedal, options.files[0], options.oldpatch,
+                options.window, manifest)
+        print("Saved", count, "patches")
+        pedal.disconnect()
+        sys.exit()
+
+    if options.restore:
+        manifest = None
+        if options.manifest:
+            manifest = Manifest(fleet_path(options.manifest, options.midiskip))
+            manifest.load()
+        (uploaded, skipped, saved, downloaded) = restore_patches(pedal,
+                options.files[0], manifest, options.oldpatch, options.window,
+                options.trust)
+        if downloaded:
+            # comparing cost about as much as uploading them all
+            print("Uploaded %d patches, skipped %d unchanged (downloaded %d to compare)" \
+                    % (uploaded, skipped, downloaded))
+        else:
+            print("Uploaded %d patches, skipped %d unchanged (saving %d bytes and %d round trips)" \
+                    % (uploaded, skipped, saved, skipped))
+        pedal.disconnect()
+        sys.exit()
+
     if options.effectdown:
         print("Downloading effect: \"" + options.files[0] + "\"" )
-        download_and_save_file(pedal, options.files[0])
+        download_and_save_file(pedal, options.files[0], resume = options.resume)
 
         filename, extension = os.path.splitext(options.files[0])
 
         if options.includezic:
             zicfilename = filename + ".ZIC"
             print("Downloading icon:   \"" + zicfilename + "\"" )
-            download_and_save_file(pedal, zicfilename)
+            download_and_save_file(pedal, zicfilename, resume = options.resume)
 
         if options.includezir:
             zirfilename = filename + ".ZIR"
             print("Downloading IR:     \"" + zirfilename + "\"" )
-            download_and_save_file(pedal, zirfilename)
+            download_and_save_file(pedal, zirfilename, resume = options.resume)
 
         pedal.disconnect()
         sys.exit()
@@ -975,14 +2962,38 @@ def main():
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
-        download_and_save_all_files(pedal, dirname)
+        manifest = None
+        if options.manifest:
+            manifest = Manifest(manifest_path(options, dirname, options.midiskip))
+            manifest.load()
+        download_and_save_all_files(pedal, dirname, options.resume, manifest)
+        pedal.disconnect()
+        sys.exit()
+
+    if options.sync:
+        dirname = options.files[0]
+        if not os.path.isdir(dirname):
+            pedal.disconnect()
+            sys.exit("Directory \"" + dirname + "\" not found")
+
+        manifest = Manifest(manifest_path(options, dirname, options.midiskip))
+        manifest.load()
+        (uploaded, unchanged, deleted) = sync_files(pedal, dirname, manifest,
+                options.orphans, options.window)
+        print("Uploaded %d, unchanged %d, removed %d" % (uploaded, unchanged, deleted))
+
+        if options.available:
+            print("Percentage disk use:", pedal.disk_usage())
         pedal.disconnect()
         sys.exit()
 
+    data = None
+    session = None
     if options.receive or options.install or options.uninstall:
-        if pedal.file_check("FLST_SEQ.ZT2"):
-            data = pedal.file_download("FLST_SEQ.ZT2")
-        pedal.file_close()
+        session = FlstSession(pedal)
+    elif options.fromdir and not os.path.exists(options.files[0]):
+        # New config, listing only the effects in directory
+        session = FlstSession(pedal, b"")
     elif not options.installonly and not options.uninstallonly:
         # Read data from local file
         infile = open(options.files[0], "rb")
@@ -991,149 +3002,53 @@ def main():
         else:
             data = infile.read()
         infile.close()
+        session = FlstSession(pedal, data)
 
-    if data and options.add and options.ver and options.id:
-        if options.id[:2] == "0x":
-            data = pedal.add_effect(data, options.add, options.ver, int(options.id, 16), not options.notadd)
-        else:
-            data = pedal.add_effect(data, options.add, options.ver, int(options.id), not options.notadd)
+    if session and (options.add or options.notadd) and options.ver and options.id:
+        session.add(options.add or options.notadd, options.ver, parse_id(options.id),
+                options.add != None)
 
-    if data and options.delete:
-        data = pedal.remove_effect(data, options.delete)
+    if session and options.delete:
+        session.remove(options.delete)
 
-    if data and options.toggle:
-        config = ZT2.parse(data)
-        groupnum=0
+    if session and options.toggle:
+        session.toggle(options.toggle)
 
-        for group in config[1]:
-            for effect in dict(group)["effects"]:
-                if dict(effect)["effect"] == options.toggle:
-                    if dict(effect)["installed"] == 1:
-                        config[1][groupnum]["effects"][0]["installed"] = 0
-                    else:
-                        config[1][groupnum]["effects"][0]["installed"] = 1
+    if session and options.apply:
+        try:
+            operations = read_operations(options.apply)
+        except (IOError, ValueError, KeyError) as error:
+            sys.exit("Unable to read operations: %s" % error)
+        session.apply(operations)
 
-            groupnum = groupnum + 1
-        data = ZT2.build(config)
+    if session and options.fromdir:
+        session.add_from_dir(options.fromdir)
 
     if options.install or options.installonly:
-        for target in options.files:
-            filename, extension = os.path.splitext(target)
-
-            if options.includezir:
-                zirfilename = filename + ".ZIR"
-                if os.path.exists(zirfilename):
-                    binfile = open(zirfilename, "rb")
-                    if binfile:
-                        bindata = binfile.read()
-                        binfile.close()
-
-                        if not pedal.file_check(zirfilename):
-                            print("Uploading IR:", zirfilename)
-                            pedal.file_upload(zirfilename, bindata)
-
-                        pedal.file_close()
-
-                        if options.available:
-                            print("Percentage disk use:", pedal.disk_usage())
-
-            if options.includezic:
-                zicfilename = filename + ".ZIC"
-                if os.path.exists(zicfilename):
-                    binfile = open(zicfilename, "rb")
-                    if binfile:
-                        bindata = binfile.read()
-                        binfile.close()
-
-                        if not pedal.file_check(zicfilename):
-                            print("Uploading icon:", zicfilename)
-                            pedal.file_upload(zicfilename, bindata)
-
-                        pedal.file_close()
-
-                        if options.available:
-                            print("Percentage disk use:", pedal.disk_usage())
-
-            binfile = open(target, "rb")
-            if binfile:
-                bindata = binfile.read()
-                binfile.close()
-
-                if not pedal.file_check(target):
-                    print("Uploading effect:", target)
-                    pedal.file_upload(target, bindata)
-
-                pedal.file_close()
-
-                if options.available:
-                    print("Percentage disk use:", pedal.disk_usage())
-
-                if data and options.install:
-                    if extension != ".ZD2":
-                        print("'%s' is not 'ZD2', skipping install" % target)
-                    else:
-                        print("Installing effect:", target)
-                        data = pedal.add_effect_from_filename(data, target)
-
+        install_files(pedal, options.files, session if options.install else None,
+                options.includezic, options.includezir, options.window,
+                options.resume, options.available)
 
     if options.uninstall or options.uninstallonly:
-        for target in options.files:
-            filename, extension = os.path.splitext(target)
-
-            if data and options.uninstall:
-                if extension != ".ZD2":
-                    print("'%s' is not 'ZD2', skipping uninstall" % target)
-                else:
-                    print("Uninstalling effect:", target)
-                    data = pedal.remove_effect(data, target)
-
-            if pedal.file_check(target):
-                print("Removing effect:", target)
-                pedal.file_delete(target)
-
-            pedal.file_close()
-
-            if options.available:
-                print("Percentage disk use:", pedal.disk_usage())
-
-            filename, extension = os.path.splitext(target)
-
-            if options.includezic:
-                zicfilename = filename + ".ZIC"
-                if pedal.file_check(zicfilename):
-                    print("Removing icon:", zicfilename)
-                    pedal.file_delete(zicfilename)
-
-                pedal.file_close()
-
-                if options.available:
-                    print("Percentage disk use:", pedal.disk_usage())
-
-            if options.includezir:
-                zirfilename = filename + ".ZIR"
-                if pedal.file_check(zirfilename):
-                    print("Removing IR:", zirfilename)
-                    pedal.file_delete(zirfilename)
-
-                pedal.file_close()
-
-                if options.available:
-                    print("Percentage disk use:", pedal.disk_usage())
+        uninstall_files(pedal, options.files, session if options.uninstall else None,
+                options.includezic, options.includezir, options.available)
 
     if options.send or options.install or options.uninstall:
-        pedal.file_check("FLST_SEQ.ZT2")
-        pedal.file_upload("FLST_SEQ.ZT2", data)
-        pedal.file_close()
+        if not session.commit(force = options.send):
+            print("FLST_SEQ unchanged, not uploaded")
 
     if pedal.is_connected():
         pedal.disconnect()
 
+    if session:
+        data = session.data()
+
     if options.dump and data:
-        config = ZT2.parse(data)
+        config = zt2_parse(data)
         print(config)
 
     if options.summary and data:
-        config = ZT2.parse(data)
+        config = zt2_parse(data)
         for group in config[1]:
             print("Group", dict(group)["group"], ":", dict(group)["groupname"])
     
@@ -1143,7 +3058,7 @@ def main():
                     dict(effect)["installed"]))
 
     if options.build and data:
-        config = ZT2.parse(data)
+        config = zt2_parse(data)
         for group in config[1]:
             for effect in dict(group)["effects"]:
                 if dict(effect)["installed"]: